@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+
+"""Shared helpers for the CSS-HTML-Prettify benchmarks."""
+
+
+import importlib.util
+import os
+import sys
+from timeit import default_timer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "css-html-prettify.py")
+
+
+def load_prettifier():
+    """Import css-html-prettify.py as a module, the dashes forbid import.
+
+    Its on sys.modules, so its functions can be pickled to Pool workers.
+    """
+    spec = importlib.util.spec_from_file_location("css_html_prettify", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_asset(relative_path):
+    """Return the text of a file bundled on the repo."""
+    with open(os.path.join(ROOT, relative_path), encoding="utf-8-sig") as fl:
+        return fl.read()
+
+
+def best_of(function, repeat=5):
+    """Run function repeat times, return the fastest time in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = default_timer()
+        function()
+        timings.append(default_timer() - started)
+    return min(timings)
+
+
+def peak_rss_bytes():
+    """Return the peak RSS of this process, ru_maxrss is KB on Linux."""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
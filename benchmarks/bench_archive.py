@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Benchmark site bundles, extract and repack versus the archive mode.
+
+Builds a .tar.gz of copies of the small bundled assets and of images, then
+prettifies it extracting to a temporary folder, prettify_files() and
+repacking, versus prettify_archive() that streams the members, printing
+the seconds of each. Both must give the same members.
+"""
+
+
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from _common import ROOT, load_prettifier
+
+
+ASSETS = ("reset.css", "responsive.css", "publicidad.css", "infobae.css",
+          "info.html", "fonts-redes/font.html")
+TARGET = (".css", ".scss", ".html", ".htm")
+
+
+def make_bundle(archive_path, files, images):
+    """Write a .tar.gz of files copies of the assets plus images."""
+    with tarfile.open(archive_path, "w:gz") as bundle:
+        for index in range(files):
+            asset = ASSETS[index % len(ASSETS)]
+            bundle.add(os.path.join(ROOT, asset), "site/{}/{}-{}".format(
+                index // 100, index, os.path.basename(asset)))
+        for index in range(images):
+            image_path = os.path.join(os.path.dirname(archive_path), "image")
+            with open(image_path, "wb") as image:
+                image.write(os.urandom(64 * 1024))
+            bundle.add(image_path, "site/imagenes/{}.jpg".format(index))
+
+
+def extract_and_repack(prettifier, archive_path, output_path, options, jobs):
+    """Extract to a temporary folder, prettify it and repack it."""
+    folder = tempfile.mkdtemp(prefix="bench-archive-")
+    try:
+        with tarfile.open(archive_path) as bundle:
+            names = bundle.getnames()
+            bundle.extractall(folder)
+        paths = [os.path.join(folder, name) for name in names
+                 if name.endswith(TARGET)]
+        results = prettifier.prettify_files(paths, options, workers=jobs)
+        with tarfile.open(output_path, "w:gz") as bundle:
+            for name in names:
+                bundle.add(os.path.join(folder, name), name, recursive=False)
+    finally:
+        shutil.rmtree(folder)
+    return results
+
+
+def members(archive_path):
+    """Return a dict of name: Bytes of the files of a tar."""
+    with tarfile.open(archive_path) as bundle:
+        return dict((member.name, bundle.extractfile(member).read())
+                    for member in bundle if member.isfile())
+
+
+def main():
+    """Print the seconds of each strategy on the same bundle."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--images", type=int, default=500)
+    parser.add_argument("--jobs", type=int, help="Worker processes.")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    prettifier = load_prettifier()
+    options = prettifier.Options(cache=False)
+    folder = tempfile.mkdtemp(prefix="bench-archive-")
+    try:
+        archive_path = os.path.join(folder, "site.tar.gz")
+        make_bundle(archive_path, args.files, args.images)
+        print("{} files, {} images, {:.1f} MegaBytes.".format(
+            args.files, args.images, os.path.getsize(archive_path) / 2 ** 20))
+        strategies = (
+            ("Extract and repack", lambda output_path: extract_and_repack(
+                prettifier, archive_path, output_path, options, args.jobs)),
+            ("Archive mode", lambda output_path: [
+                result for _, result in prettifier.prettify_archive(
+                    archive_path, output_path, TARGET, (), options,
+                    args.jobs)]))
+        outputs = []
+        for name, prettify in strategies:
+            outputs.append(os.path.join(folder, "{}.tar.gz".format(
+                len(outputs))))
+            started = time.perf_counter()
+            results = prettify(outputs[-1])
+            seconds = time.perf_counter() - started
+            assert all(result.ok for result in results)
+            print("{:<22}{:>10.2f}s{:>12.0f} files/s".format(
+                name, seconds, (args.files + args.images) / seconds))
+        assert members(outputs[0]) == members(outputs[1])
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ in '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Benchmark the throughput of folders of small files, Pool versus asyncio.
+
+Copies the small bundled assets into a temporary tree of thousands of
+files and prettifies it with prettify_files() on a process Pool, and with
+the prettify_files_async() pipeline, printing files per second of each.
+With --latency each read and write sleeps first, like a network disk.
+"""
+
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from _common import ROOT, load_prettifier
+
+
+ASSETS = ("reset.css", "responsive.css", "publicidad.css", "infobae.css",
+          "info.html", "fonts-redes/font.html")
+
+
+def make_tree(folder, files):
+    """Fill folder with files copies of the assets, 100 per sub folder."""
+    paths = []
+    for index in range(files):
+        asset = ASSETS[index % len(ASSETS)]
+        sub_folder = os.path.join(folder, str(index // 100))
+        os.makedirs(sub_folder, exist_ok=True)
+        paths.append(os.path.join(sub_folder, "{}-{}".format(
+            index, os.path.basename(asset))))
+        shutil.copyfile(os.path.join(ROOT, asset), paths[-1])
+    return paths
+
+
+def slow(function, latency):
+    """Return function, sleeping latency seconds before each call."""
+    def delayed(*args, **kwargs):
+        time.sleep(latency)
+        return function(*args, **kwargs)
+    return delayed
+
+
+def main():
+    """Print files per second of each strategy on a fresh tree each."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=3000)
+    parser.add_argument("--jobs", type=int, help="Worker processes.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds each read and write waits first.")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    prettifier = load_prettifier()
+    if args.latency:  # Workers fork after this, so they are slow too.
+        prettifier.read_text = slow(prettifier.read_text, args.latency)
+        prettifier.write_outputs = slow(prettifier.write_outputs,
+                                        args.latency)
+    options = prettifier.Options(cache=False)
+    strategies = (
+        ("Pool imap_unordered", lambda paths: prettifier.prettify_files(
+            paths, options, workers=args.jobs)),
+        ("asyncio pipeline", lambda paths: prettifier.prettify_files_async(
+            paths, options, workers=args.jobs)))
+    print("{} files, {}s latency.".format(args.files, args.latency))
+    for name, prettify_files in strategies:
+        folder = tempfile.mkdtemp(prefix="bench-folder-")
+        try:
+            paths = make_tree(folder, args.files)
+            started = time.perf_counter()
+            results = prettify_files(paths)
+            seconds = time.perf_counter() - started
+        finally:
+            shutil.rmtree(folder)
+        assert all(result.ok for result in results)
+        print("{:<22}{:>10.2f}s{:>12.0f} files/s".format(
+            name, seconds, args.files / seconds))
+
+
+if __name__ in '__main__':
+    sys.exit(main())
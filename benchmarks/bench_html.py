@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Benchmark the throughput of the HTML engines, Stream versus BS4.
+
+Runs html_prettify() on info.html as many small documents and as one big
+document, prints MegaBytes per second of each engine and parser installed.
+"""
+
+
+import logging
+import sys
+from argparse import ArgumentParser
+from importlib.util import find_spec
+
+from _common import best_of, load_prettifier, read_asset
+
+
+def engines():
+    """Return (name, engine, parser) of all the HTML engines installed."""
+    found = [("stream", "stream", None)]
+    if not find_spec("bs4"):
+        print("bs4 is not installed, only the Stream engine is measured.")
+        return found
+    found.append(("bs4 html.parser", "bs4", "html.parser"))
+    if find_spec("lxml"):
+        found.append(("bs4 lxml", "bs4", "lxml"))
+    return found
+
+
+def main():
+    """Print the throughput of each HTML engine."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    prettifier = load_prettifier()
+    html = read_asset("info.html")
+    big_html = html * args.documents
+    installed = engines()
+    print("{:<18}{:>16}{:>16}".format("Engine", "Documents MB/s",
+                                      "Big one MB/s"))
+    for name, engine, html_parser in installed:
+        def documents():
+            for _ in range(args.documents):
+                prettifier.html_prettify(html, engine=engine,
+                                         parser=html_parser)
+
+        def big_document():
+            prettifier.html_prettify(big_html, engine=engine,
+                                     parser=html_parser)
+
+        megabytes = len(big_html.encode("utf-8")) / 2 ** 20
+        print("{:<18}{:>16.2f}{:>16.2f}".format(
+            name, megabytes / best_of(documents, args.repeat),
+            megabytes / best_of(big_document, args.repeat)))
+
+
+if __name__ in '__main__':
+    sys.exit(main())
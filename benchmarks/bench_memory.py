@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Benchmark the peak memory of the CSS white space stages by input size.
+
+Repeats commoninfobae.css up to several sizes and runs each stage on a fresh
+interpreter, prints the peak RSS over the baseline (input already loaded),
+that must grow proportional to the input size, not faster.
+"""
+
+
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+from _common import SCRIPT, load_prettifier, peak_rss_bytes, read_asset
+
+
+STAGES = ("normalize_whitespace", "justify_right", "css_prettify")
+SIZES_MB = (1, 2, 4, 8)
+
+
+def make_css(size_mb):
+    """Return a stylesheet of about size_mb MegaBytes."""
+    css = read_asset("commoninfobae.css")
+    return css * (size_mb * 1024 * 1024 // len(css) + 1)
+
+
+def measure(stage, size_mb):
+    """Run stage on a stylesheet of size_mb, print the peak RSS growth."""
+    prettifier = load_prettifier()
+    css = make_css(size_mb)
+    baseline = peak_rss_bytes()
+    getattr(prettifier, stage)(css)
+    print(peak_rss_bytes() - baseline, len(css))
+
+
+def main():
+    """Print the peak memory growth of each stage per input size."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--child", nargs=2, metavar=("STAGE", "SIZE_MB"),
+                        help="internal, measure one stage on a fresh process")
+    args = parser.parse_args()
+    if args.child:
+        return measure(args.child[0], int(args.child[1]))
+    print("{:<22}{:>8}{:>14}{:>12}".format("Stage", "Input", "Peak growth",
+                                           "Per input"))
+    for stage in STAGES:
+        for size_mb in SIZES_MB:
+            output = subprocess.check_output(
+                [sys.executable, __file__, "--child", stage, str(size_mb)],
+                universal_newlines=True)
+            growth, input_size = map(int, output.split())
+            print("{:<22}{:>6.1f}MB{:>12.1f}MB{:>11.2f}x".format(
+                stage, input_size / 2 ** 20, growth / 2 ** 20,
+                growth / input_size))
+    print("Prettifier: {}".format(SCRIPT))
+
+
+if __name__ in '__main__':
+    sys.exit(main())
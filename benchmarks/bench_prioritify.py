@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Benchmark the CSS property priority lookup used to sort properties.
+
+Compares declarations per second of the old linear scan over the full
+prop list, versus the precomputed property priority index.
+"""
+
+
+from _common import best_of, load_prettifier, read_asset
+
+
+ASSETS = ("commoninfobae.css", "fonts-redes/css/font-awesome.css")
+
+
+def linear_prioritify(line_buffer, pgs):
+    """The old _prioritify, a str.find() for each prop on the list."""
+    props, groups = pgs
+    priority, group = 9999, 0
+    for css_property in props:
+        if line_buffer.find(css_property + ':') != -1:
+            priority = props.index(css_property)
+            group = groups[priority]
+            break
+    return priority, group
+
+
+def rule_declarations(prettifier, css):
+    """Return the Declarations of all rule bodies of css, as its sorted."""
+    declarations, position = [], 0
+    while True:
+        opening = css.find("{", position)
+        closing = css.find("}", opening + 1) if opening != -1 else -1
+        if closing == -1:
+            return declarations
+        declarations += prettifier._split_declarations(
+            css, opening + 1, closing)
+        position = closing + 1
+
+
+def main():
+    """Print declarations per second for both strategies on each asset."""
+    prettifier = load_prettifier()
+    for grouped in (False, True):
+        props = prettifier._compile_props(prettifier.CSS_PROPS_TEXT, grouped)
+        index = prettifier.CSS_PGS[grouped]
+        for asset in ASSETS:
+            declarations = rule_declarations(prettifier, read_asset(asset))
+            assert [linear_prioritify(_, props) for _ in declarations] == [
+                prettifier._prioritify(_, index) for _ in declarations]
+            linear = best_of(lambda: [linear_prioritify(_, props)
+                                      for _ in declarations])
+            indexed = best_of(lambda: [prettifier._prioritify(_, index)
+                                       for _ in declarations])
+            print("{} ({} declarations, grouped={})".format(
+                asset, len(declarations), grouped))
+            print("    linear scan: {:>12,.0f} declarations/s".format(
+                len(declarations) / linear))
+            print("    index:       {:>12,.0f} declarations/s  x{:.1f}".format(
+                len(declarations) / indexed, linear / indexed))
+
+
+if __name__ in '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Benchmark the rewrite rules stage and the wrap of lines by str.find().
+
+Compares, for 1 to all the rewrite rules, the old steps, one re.sub() of
+a pattern string over the whole CSS per rule, a single scan of the rules
+of the rewrite stage combined on one alternation with a dispatch table,
+and the rewrite stage, the same precompiled patterns that keep its
+literal prefix search but still scan the CSS once per rule. Prints the
+scans of the CSS each one makes, counted on the compiled functions. Then
+the old character by character wrap_css_lines() versus str.find() jumps.
+"""
+
+
+import re
+import sys
+from argparse import ArgumentParser
+from functools import partial
+
+from _common import best_of, load_prettifier, read_asset
+
+
+OLD_ZERO_UNITS = (r"([\s:])(0)(px|em|%|in|cm|mm|pc|pt|ex)", r"\1\2")
+EXTRA_RULES = (  # Sample rules to register, as a user would.
+    ("short_hex", r"#([0-9a-fA-F])\1([0-9a-fA-F])\2([0-9a-fA-F])\3\b",
+     r"#\1\2\3"),
+    ("zero_decimals", r"([\s:])0+\.(\d)", r"\1.\2"),
+    ("lower_important", r"!\s*IMPORTANT", "!important"),
+)
+
+
+def enumerate_wrap_css_lines(css, line_length=80):
+    """The old wrap_css_lines(), enumerate() over every character."""
+    lines, line_start = [], 0
+    for i, char in enumerate(css):
+        if char == '}' and (i - line_start >= line_length):
+            lines.append(css[line_start:i + 1])
+            line_start = i + 1
+    if line_start < len(css):
+        lines.append(css[line_start:])
+    return '\n'.join(lines)
+
+
+def sequential_rewrite(css, rules):
+    """Apply each rule on its own re.sub() pass, like the old steps."""
+    for pattern, replacement in rules:
+        css = re.sub(pattern, replacement, css)
+    return css
+
+
+def combine(rules):
+    """Return a function applying rules on one alternation, single scan.
+
+    Each rule gets its own group, templates are shifted to its group
+    numbers, and the group matched picks the replacement on a dispatch
+    table. Rules must not use backreferences, for brevity.
+    """
+    parts, dispatch, group = [], {}, 1
+    for pattern, replacement in rules:
+        parts.append("({})".format(pattern))
+        dispatch[group] = re.sub(r"\\(\d+)", lambda match, group=group: (
+            r"\g<{}>".format(group + int(match.group(1)))), replacement)
+        group += 1 + re.compile(pattern).groups
+    combined = re.compile("|".join(parts))
+    return partial(combined.sub, lambda match: match.expand(
+        dispatch[match.lastindex]))
+
+
+def scans(prettifier, rewrite):
+    """Return the scans of the CSS a compiled rewrite function makes."""
+    if isinstance(rewrite, partial) and rewrite.func is prettifier._rewrite:
+        return len(rewrite.args[0])  # One re.sub() per rule.
+    return 1
+
+
+def main():
+    """Print scans and seconds of each strategy, for 1 to all the rules."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--copies", type=int, default=200,
+                        help="Copies of commoninfobae.css to rewrite.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    prettifier = load_prettifier()
+    css = read_asset("commoninfobae.css") * args.copies
+    print("Input: {:.1f} MegaBytes, scans of it and seconds of each.".format(
+        len(css) / 2 ** 20))
+    print("{:<7}{:>14}{:>18}{:>18}".format(
+        "Rules", "Old steps", "Combined scan", "Rewrite stage"))
+    for name, pattern, replacement in EXTRA_RULES:
+        prettifier.register_rewrite_rule(name, pattern, replacement)
+    old_rules = (OLD_ZERO_UNITS, ) + tuple(
+        rule[1:] for rule in EXTRA_RULES if "\\1" not in rule[1])
+    for count in range(1, len(old_rules) + 1):
+        rules = prettifier.rewrite_rules()[:1] + old_rules[1:count]
+        rewrite = prettifier.compile_rewrite_rules(rules)
+        combined = combine(rules)  # Same patterns, only the scans differ.
+        expected = sequential_rewrite(css, old_rules[:count])
+        assert rewrite(css) == combined(css) == expected
+        timings = [best_of(lambda: function(css), args.repeat) for function
+                   in (partial(sequential_rewrite, rules=old_rules[:count]),
+                       combined, rewrite)]
+        print("{:<7}{:>7} {:.4f}s{:>11} {:.4f}s{:>11} {:.4f}s".format(
+            count, len(old_rules[:count]), timings[0], 1, timings[1],
+            scans(prettifier, rewrite), timings[2]))
+    assert enumerate_wrap_css_lines(css) == prettifier.wrap_css_lines(css)
+    enumerated = best_of(lambda: enumerate_wrap_css_lines(css), args.repeat)
+    found = best_of(lambda: prettifier.wrap_css_lines(css), args.repeat)
+    print("wrap_css_lines: enumerate() {:.4f}s, str.find() {:.4f}s, "
+          "x{:.1f}".format(enumerated, found, enumerated / found))
+
+
+if __name__ in '__main__':
+    sys.exit(main())
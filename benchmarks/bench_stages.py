@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Benchmark every stage of the CSS and HTML pipelines, with a regression gate.
+
+Runs each Legacy CSS stage on the output of the previous one, the whole
+CSS engines and the HTML engines, on synthetic corpora and the bundled
+assets. Prints the time, MegaBytes per second and peak memory of each,
+saves them as JSON, and exits with 1 if a stage is slower than threshold
+versus a stored baseline.
+"""
+
+
+import json
+import logging
+import os
+import platform
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from importlib.util import find_spec
+
+from _common import ROOT, best_of, load_prettifier, read_asset
+
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+CSS_STAGES = ("sort_properties", "rewrite_css", "wrap_css_lines",
+              "condense_semicolons", "normalize_whitespace", "justify_right",
+              "add_encoding")
+
+
+def many_small_rules(scale):
+    """Return CSS with lots of small rules."""
+    return "".join(
+        ".item-{0} {{ z-index: {0}; color: red; margin: 0px;\n"
+        "    padding: 0em 1px; }}\n".format(index)
+        for index in range(20000 * scale))
+
+
+def deep_media_nesting(scale, depth=12):
+    """Return CSS with blocks of deeply nested @media rules."""
+    block = "".join("@media (min-width: {}px) {{\n".format(level * 10)
+                    for level in range(depth))
+    block += "    a {\n        top: 0px; color: blue;;\n    }\n"
+    return (block + "}\n" * depth) * (1500 * scale)
+
+
+def huge_single_rule(scale):
+    """Return CSS of one rule with lots of declarations."""
+    return "body {\n" + "".join(
+        "    --custom-{0}: {0}px; margin-top: 0px; color: #fff;\n".format(
+            index) for index in range(20000 * scale)) + "}\n"
+
+
+def large_html(scale):
+    """Return a big HTML document, with nesting, tables and raw elements."""
+    row = ("<tr><td class='cell'>Row {0} &amp; data</td><td>{0}<br>"
+           "<img src='x.png'></td></tr>\n")
+    section = ("<div class='section'><h2>Title</h2><ul><li>one<li>two</ul>"
+               "<table>" + "".join(row.format(index) for index in range(20)) +
+               "</table><pre>  keep   this\n  as is</pre>"
+               "<script>if (a < b) { c(); }</script></div>\n")
+    return ("<!DOCTYPE html><html><head><title>Big</title></head><body>" +
+            section * (1000 * scale) + "</body></html>")
+
+
+def corpora(scale):
+    """Return a dict of name: (kind, text) of all the corpora."""
+    return {
+        "many_small_rules": ("css", many_small_rules(scale)),
+        "deep_media_nesting": ("css", deep_media_nesting(scale)),
+        "huge_single_rule": ("css", huge_single_rule(scale)),
+        "large_html": ("html", large_html(scale)),
+        "commoninfobae.css": ("css", read_asset("commoninfobae.css") * 20),
+        "font-awesome.css": ("css", read_asset(
+            "fonts-redes/css/font-awesome.css") * 5),
+        "info.html": ("html", read_asset("info.html") * 20),
+    }
+
+
+def stages(prettifier, kind, text):
+    """Yield (stage name, function, input text) for a corpus.
+
+    Legacy CSS stages take the output of the previous stage as input.
+    """
+    if kind == "html":
+        yield "html_prettify stream", prettifier.html_prettify, text
+        if find_spec("bs4"):
+            yield "html_prettify bs4", lambda html: prettifier.html_prettify(
+                html, engine="bs4"), text
+        return
+    stage_input = text
+    for name in CSS_STAGES:
+        function = getattr(prettifier, name)
+        yield name, function, stage_input
+        stage_input = function(stage_input)
+    yield "legacy_css_prettify", prettifier.legacy_css_prettify, text
+    yield "css_prettify", prettifier.css_prettify, text
+
+
+def peak_memory(function, text):
+    """Return the peak of memory allocated running function, in Bytes."""
+    tracemalloc.start()
+    try:
+        function(text)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(scale, repeat):
+    """Return the results of all stages on all corpora, printing them."""
+    prettifier, results = load_prettifier(), {}
+    print("{:<20}{:<24}{:>10}{:>10}{:>10}".format(
+        "Corpus", "Stage", "Seconds", "MB/s", "Peak MB"))
+    for corpus, (kind, text) in corpora(scale).items():
+        for name, function, stage_input in stages(prettifier, kind, text):
+            megabytes = len(stage_input.encode("utf-8")) / 2 ** 20
+            seconds = best_of(lambda: function(stage_input), repeat)
+            result = {"seconds": seconds, "megabytes": megabytes,
+                      "mb_per_s": megabytes / seconds if seconds else 0.0,
+                      "peak_mb": peak_memory(function, stage_input) / 2 ** 20}
+            results.setdefault(corpus, {})[name] = result
+            print("{:<20}{:<24}{:>10.4f}{:>10.2f}{:>10.1f}".format(
+                corpus, name, seconds, result["mb_per_s"], result["peak_mb"]))
+    return results
+
+
+def regressions(results, baseline, threshold, min_seconds=0.005):
+    """Return a list of the stages slower than threshold versus baseline.
+
+    Differences under min_seconds are noise, not regressions.
+    """
+    slower = []
+    for corpus, corpus_stages in results.items():
+        for name, result in corpus_stages.items():
+            expected = baseline.get(corpus, {}).get(name)
+            if expected and result["seconds"] > max(
+                    expected["seconds"] * (1 + threshold),
+                    expected["seconds"] + min_seconds):
+                slower.append("{} {}: {:.4f}s, baseline {:.4f}s.".format(
+                    corpus, name, result["seconds"], expected["seconds"]))
+    return slower
+
+
+def main():
+    """Benchmark all stages, save JSON, compare versus the baseline."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=1,
+                        help="Multiply the size of the synthetic corpora.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Save the results to a JSON file.")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="JSON results to compare to, if it exists.")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Save the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Fail if a stage is this fraction slower.")
+    parser.add_argument("--min-seconds", type=float, default=0.005,
+                        help="Ignore differences shorter than this.")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    results = {"python": platform.python_version(), "scale": args.scale,
+               "stages": measure(args.scale, args.repeat)}
+    for path in filter(None, (args.output, args.save_baseline and
+                              args.baseline)):
+        with open(path, "w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+        print("Results saved to {}.".format(path))
+    if args.save_baseline or not os.path.isfile(args.baseline):
+        return 0
+    with open(args.baseline, encoding="utf-8") as json_file:
+        baseline = json.load(json_file)
+    if baseline.get("scale") != args.scale:
+        print("Baseline has a different scale, not compared.")
+        return 0
+    slower = regressions(results["stages"], baseline["stages"],
+                         args.threshold, args.min_seconds)
+    for regression in slower:
+        print("Regression: " + regression)
+    print("{} stages slower than {:.0%} over the baseline.".format(
+        len(slower), args.threshold))
+    return 1 if slower else 0
+
+
+if __name__ in '__main__':
+    sys.exit(main())
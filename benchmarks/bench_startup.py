@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Benchmark the start up time of a single CSS file run of the CLI.
+
+Runs css-html-prettify.py on a copy of commoninfobae.css several times,
+prints the median wall time and the slowest imports from -X importtime,
+exits with 1 if the median is over the target.
+"""
+
+
+import os
+import shutil
+import subprocess
+import sys
+from argparse import ArgumentParser
+from statistics import median
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from _common import ROOT, SCRIPT
+
+
+def run_once(css_file_path, *python_flags):
+    """Run the CLI on css_file_path, return (wall time, stderr)."""
+    command = [sys.executable] + list(python_flags) + [
+        SCRIPT, css_file_path, "--quiet", "--no-cache"]
+    started = default_timer()
+    completed = subprocess.run(command, stderr=subprocess.PIPE, check=True,
+                               universal_newlines=True)
+    return default_timer() - started, completed.stderr
+
+
+def slowest_imports(importtime_output, top=10):
+    """Parse -X importtime output, return the top level slowest imports."""
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split(":", 1)[1].split("|")
+        if not name[1:].startswith(" "):  # Only top level imports.
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    """Print the start up time, fail if its over the target."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--target-ms", type=float, default=120.0)
+    args = parser.parse_args()
+    folder = mkdtemp()
+    try:
+        css_file_path = shutil.copy(
+            os.path.join(ROOT, "commoninfobae.css"), folder)
+        timings = [run_once(css_file_path)[0] for _ in range(args.runs)]
+        _, importtime_output = run_once(css_file_path, "-X", "importtime")
+    finally:
+        shutil.rmtree(folder)
+    print("Slowest imports (cumulative microseconds):")
+    for cumulative, name in slowest_imports(importtime_output):
+        print("    {:>8} {}".format(cumulative, name))
+    median_ms = median(timings) * 1000
+    print("Single CSS file run: median {:.1f} ms, min {:.1f} ms, target "
+          "{:.1f} ms.".format(median_ms, min(timings) * 1000, args.target_ms))
+    return 0 if median_ms <= args.target_ms else 1
+
+
+if __name__ in '__main__':
+    sys.exit(main())
@@ -9,28 +9,28 @@ Unicode-ready Python3-ready Prettifier Beautifier for the Web.
 """
 
 
+import heapq
+import io
 import itertools
 import logging as log
 import os
 import re
+import struct
 import sys
+import threading
 from argparse import ArgumentParser
+from collections import namedtuple
+from contextlib import contextmanager
 from copy import copy
-from ctypes import byref, cdll, create_string_buffer
 from datetime import datetime
-from doctest import testmod
-from multiprocessing import cpu_count, Pool
-from tempfile import gettempdir
-from time import sleep
+from fnmatch import fnmatchcase
+from functools import lru_cache, partial
+from time import monotonic, sleep
 
-from bs4 import BeautifulSoup
-
-try:
-    from urllib import request
-    from subprocess import getoutput
-    import resource  # windows dont have resource
-except ImportError:
-    request = getoutput = resource = None
+# Heavy imports are deferred to the code that needs them, to start quick:
+# bs4 only for HTML, multiprocessing only for folders, watch and daemon,
+# asyncio only for --asyncio, tarfile and zipfile only for archives, urllib
+# only for --checkupdates, ctypes only for inotify, prctl and malloc_trim.
 
 
 __version__ = "1.0.0"
@@ -43,6 +43,29 @@ __source__ = ("https://raw.githubusercontent.com/juancarlospaco/"
 
 
 start_time = datetime.now()
+CACHE_HIT, CACHE_MISS = "hit", "miss"
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                         os.path.expanduser("~/.cache"), "css-html-prettify")
+Options = namedtuple("Options", "group justify prefix timestamp golden cache "
+                     "cache_dir cache_size indent split_threshold stream "
+                     "html_engine html_parser profile profile_dir check diff "
+                     "minify max_worker_mem tasks_per_child")
+Options.__new__.__defaults__ = (False, False, None, False, False, False,
+                                CACHE_DIR, 64, 4, None, False, "stream",
+                                "html.parser", False, None, False, False,
+                                False, None, None)
+Result = namedtuple("Result",
+                    "ok cache_status metrics error changed diff worker")
+Result.__new__.__defaults__ = (None, None, False, None, None)
+Prettified = namedtuple("Prettified", "ok cache_status metrics outputs")
+PROFILE_IDS = itertools.count()  # Names cProfile dumps of a process.
+STREAM_SIZE = 64 * 1024  # Characters read and buffered at once to stream.
+RULES_BATCH = 256  # Rules rewritten, wrapped and split in lines at once.
+SIZE_WINDOW = 256  # Files found on a walk before dispatching largest first.
+IN_FLIGHT = 64  # Files on the --asyncio pipeline at once.
+PATH_SIZE = 256 * 1024  # Bigger files go to --asyncio workers as paths.
+TASKS_PER_CHILD = 256  # Files a worker processes with --max-worker-mem.
+SHARD_MANIFEST = "css-html-prettify-shard-{}-of-{}.json"
 CSS_PROPS_TEXT = '''
 
 alignment-adjust alignment-baseline animation animation-delay
@@ -151,16 +174,38 @@ def _compile_props(props_text, grouped=False):
     return final_props, groups
 
 
+def _index_props(props_text, grouped=False):
+    """Take a list of props and index them by name, to prioritify quickly.
+
+    A name gets the priority of the first prop that is a suffix of it, same
+    as searching 'prop:' on it, eg. '-webkit-transition' gets 'transition'.
+    """
+    props, groups = _compile_props(props_text, grouped=grouped)
+    index = {}
+    for priority, css_property in enumerate(props):
+        index.setdefault(css_property, priority)
+    for css_property in index:
+        index[css_property] = _suffix_priority(css_property, index)
+    return index, groups
+
+
+def _suffix_priority(name, index):
+    """Return the smallest priority of all the suffixes of name on index."""
+    return min(index.get(name[i:], 9999) for i in range(len(name)))
+
+
 def _prioritify(line_buffer, pgs):
     """Return args priority, priority is integer and smaller means higher."""
-    props, groups = pgs
-    priority, group = 9999, 0
-    for css_property in props:
-        if line_buffer.find(css_property + ':') != -1:
-            priority = props.index(css_property)
-            group = groups[priority]
-            break
-    return priority, group
+    index, groups = pgs
+    priority = 9999
+    for name in RE_PROP_NAME.findall(line_buffer):
+        name_priority = index.get(name)
+        if name_priority is None:  # Unknown or vendor prefixed property.
+            name_priority = _suffix_priority(name, index)
+            if len(index) < INDEX_LIMIT:
+                index[name] = name_priority
+        priority = min(priority, name_priority)
+    return priority, groups[priority] if priority != 9999 else 0
 
 
 def _props_grouper(props, pgs):
@@ -186,7 +231,53 @@ def _props_grouper(props, pgs):
     return props
 
 
-def sort_properties(css_unsorted_string):
+RE_PROP_NAME = re.compile(r"[a-z-]+(?=:)")
+INDEX_LIMIT = 8192  # Max names on the index, including the unknown ones.
+CSS_PGS = (_index_props(CSS_PROPS_TEXT),
+           _index_props(CSS_PROPS_TEXT, grouped=True))
+BLOCK_MEMO_SIZE = 4096  # Sorted Declaration blocks memoized per process.
+BLOCK_MEMO_MAX = 64  # Blocks with more Declarations are sorted every time.
+MEMO_CLEARED = [0, 0]  # Hits and misses of the memo before it was cleared.
+
+
+def _sorted_block(declarations, pgs):
+    """Return a block of Declarations sorted, memoized unless too big.
+
+    Vendor CSS repeats the same blocks, across files too, so the memo lives
+    as long as the process. Its keyed by the exact Declarations, the output
+    keeps its white space, and if its grouped.
+    """
+    if len(declarations) > BLOCK_MEMO_MAX:
+        return _props_grouper(declarations, pgs)
+    if pgs is CSS_PGS[False]:
+        return _memo_sorted_block(tuple(declarations), False)
+    if pgs is CSS_PGS[True]:
+        return _memo_sorted_block(tuple(declarations), True)
+    return _props_grouper(declarations, pgs)
+
+
+@lru_cache(maxsize=BLOCK_MEMO_SIZE)
+def _memo_sorted_block(declarations, grouped):
+    """Return a block of Declarations sorted, on a bounded LRU memo."""
+    return tuple(_props_grouper(list(declarations), CSS_PGS[grouped]))
+
+
+def block_memo_counters():
+    """Return (PID, hits, misses) of the sorted blocks memo of the process."""
+    info = _memo_sorted_block.cache_info()
+    return (os.getpid(), MEMO_CLEARED[0] + info.hits,
+            MEMO_CLEARED[1] + info.misses)
+
+
+def clear_block_memo():
+    """Empty the sorted blocks memo, its counters keep growing."""
+    info = _memo_sorted_block.cache_info()
+    MEMO_CLEARED[0] += info.hits
+    MEMO_CLEARED[1] += info.misses
+    _memo_sorted_block.cache_clear()
+
+
+def sort_properties(css_unsorted_string, group=False):
     """CSS Property Sorter Function.
 
     This function will read buffer argument, split it to a list by lines,
@@ -194,7 +285,7 @@ def sort_properties(css_unsorted_string):
     This function depends on '_prioritify' function.
     """
     log.debug("Alphabetically Sorting all CSS / SCSS Properties.")
-    css_pgs = _compile_props(CSS_PROPS_TEXT, grouped=bool(args.group))
+    css_pgs = CSS_PGS[bool(group)]
     pattern = re.compile(r'(.*?{\r?\n?)(.*?)(}.*?)|(.*)',
                          re.DOTALL + re.MULTILINE)
     matched_patterns = pattern.findall(css_unsorted_string)
@@ -207,7 +298,7 @@ def sort_properties(css_unsorted_string):
             props = map(lambda line: line.lstrip('\n'),
                         RE_prop.findall(matched_groups[1]))
             props = list(filter(lambda line: line.strip('\n '), props))
-            props = _props_grouper(props, css_pgs)
+            props = _sorted_block(props, css_pgs)
             sorted_patterns += props
             sorted_patterns += matched_groups[2].splitlines(True)
             sorted_patterns += matched_groups[3].splitlines(True)
@@ -216,32 +307,49 @@ def sort_properties(css_unsorted_string):
 
 
 def remove_empty_rules(css):
-    """Remove empty rules."""
+    """Remove empty rules, and blocks like @media left empty by that.
+
+    Strings and comments are matched first and kept, so braces on them
+    are not taken as rules.
+    """
     log.debug("Removing all unnecessary empty rules.")
-    return re.sub(r"[^\}\{]+\{\}", "", css)
+    while True:
+        removed = RE_EMPTY_RULES.sub(_kept_or_removed, css)
+        if removed == css:
+            return css
+        css = removed
+
+
+def _kept_or_removed(match):
+    """Return a string or comment as is, remove an empty rule."""
+    return match.group(1) or ""
 
 
 def condense_zero_units(css):
     """Replace `0(px, em, %, etc)` with `0`."""
     log.debug("Condensing all zeroes on values.")
-    return re.sub(r"([\s:])(0)(px|em|%|in|cm|mm|pc|pt|ex)", r"\1\2", css)
+    return RE_ZERO_UNITS.sub("0", css)
 
 
 def condense_semicolons(css):
     """Condense multiple adjacent semicolon characters into one."""
     log.debug("Condensing all unnecessary multiple adjacent semicolons.")
-    return re.sub(r";;+", ";", css)
+    return RE_SEMICOLONS.sub(";", css)
 
 
 def wrap_css_lines(css, line_length=80):
-    """Wrap the lines of the given CSS to an approximate length."""
-    log.debug("Wrapping lines to ~{} max line lenght.".format(line_length))
+    """Wrap the lines of the given CSS to an approximate length.
+
+    Its safe to break after } characters, the first one at line_length or
+    more from the line start, so str.find() jumps straight to it.
+    """
+    log.debug("Wrapping lines to ~%s max line lenght.", line_length)
     lines, line_start = [], 0
-    for i, char in enumerate(css):
-        # Its safe to break after } characters.
-        if char == '}' and (i - line_start >= line_length):
-            lines.append(css[line_start:i + 1])
-            line_start = i + 1
+    closing = css.find("}", line_length)
+    while closing != -1:
+        lines.append(css[line_start:closing + 1])
+        line_start = closing + 1
+        closing = css.find("}", line_start + line_length)
     if line_start < len(css):
         lines.append(css[line_start:])
     return '\n'.join(lines)
@@ -255,59 +363,604 @@ def add_encoding(css):
 
 def normalize_whitespace(css):
     """Normalize css string white spaces."""
-    css_no_trailing_whitespace = ""
-    for line_of_css in css.splitlines():  # remove all trailing white spaces
-        css_no_trailing_whitespace += line_of_css.rstrip() + "\n"
-    css = css_no_trailing_whitespace
-    css = re.sub(r"\n{3}", "\n\n\n", css)  # if 3 new lines,make them 2
-    css = re.sub(r"\n{5}", "\n\n\n\n\n", css)  # if 5 new lines, make them 4
-    h_line = "/* {} */".format("-" * 72)  # if >6 new lines, horizontal line
-    css = re.sub(r"\n{6,}", "\n\n\n\n\n{}\n\n\n\n\n".format(h_line), css)
-    css = css.replace(" ;\n", ";\n").replace("{\n", " {\n")
-    css = re.sub("\s{2,}{\n", " {\n", css)
-    return css.replace("\t", "    ").rstrip("\n") + "\n\n"
+    return _join_lines(iter_normalized_lines(iter_text_lines(css)))
 
 
 def justify_right(css):
     """Justify to the Right all CSS properties on the argument css string."""
     log.debug("Justify to the Right all CSS / SCSS Property values.")
-    max_indent, right_justified_css = 1, ""
-    for css_line in css.splitlines():
-        c_1 = len(css_line.split(":")) == 2 and css_line.strip().endswith(";")
-        c_2 = "{" not in css_line and "}" not in css_line and len(css_line)
-        if c_1 and c_2:
-            lenght = len(css_line.split(":")[0].rstrip()) + 1
-            max_indent = lenght if lenght > max_indent else max_indent
-    for line_of_css in css.splitlines():
-        c_1 = "{" not in line_of_css and "}" not in line_of_css
-        c_2 = max_indent > 1 and len(line_of_css.split(":")) == 2
-        c_3 = line_of_css.strip().endswith(";") and len(line_of_css)
-        if c_1 and c_2 and c_3:
-            propert_len = len(line_of_css.split(":")[0].rstrip()) + 1
-            xtra_spaces = " " * (max_indent + 1 - propert_len)
-            xtra_spaces = ":" + xtra_spaces
-            justified_line_of_css = ""
-            justified_line_of_css = line_of_css.split(":")[0].rstrip()
-            justified_line_of_css += xtra_spaces
-            justified_line_of_css += line_of_css.split(":")[1].lstrip()
-            right_justified_css += justified_line_of_css + "\n"
+    max_indent = _max_indent(iter_text_lines(css))  # 2 passes, no buffer.
+    return _justify_text(css, max_indent) + "\n" if max_indent > 1 else css
+
+
+###############################################################################
+# Rewrite rules
+
+
+REWRITE_RULES = {  # Name: (pattern, replacement), in order of registration.
+    "zero_units": (r"0(?<=[\s:]0)(?:px|em|%|in|cm|mm|pc|pt|ex)", "0"),
+}
+
+
+def register_rewrite_rule(name, pattern, replacement):
+    """Register a rewrite rule, applied on the same stage as the zero units.
+
+    Replacement is a template like on re.sub() or a function of the matched
+    text. Rules run in order of registration, each on the output of the
+    previous one, so each rule is one more scan of the CSS. They must not
+    match across a '}', since the Rules engine rewrites batches of
+    rules. Pool workers get the rules registered before they fork.
+    """
+    re.compile(pattern)  # Fail here, not when prettifying.
+    REWRITE_RULES[name] = (pattern, replacement)
+
+
+def unregister_rewrite_rule(name):
+    """Unregister a rewrite rule by name, KeyError if its not registered."""
+    del REWRITE_RULES[name]
+
+
+def rewrite_rules():
+    """Return the (pattern, replacement) of all rewrite rules, in order."""
+    return tuple(REWRITE_RULES.values())
+
+
+@lru_cache(maxsize=32)
+def compile_rewrite_rules(rules):
+    """Compile rules into one function that applies all of them, in order.
+
+    Each rule keeps its own precompiled pattern and scan of the CSS, N rules
+    are N scans. Joined on one alternation, a single scan, re can not search
+    the literal prefix of each, and its slower.
+    """
+    subs = tuple(partial(re.compile(pattern).sub, partial(
+        _rewrite_match, replacement) if callable(replacement) else
+        replacement) for pattern, replacement in rules)
+    return subs[0] if len(subs) == 1 else partial(_rewrite, subs)
+
+
+def _rewrite(subs, css):
+    """Apply each compiled rewrite rule of subs on css, in order.
+
+    Its one scan of css per rule, not a single pass.
+    """
+    for sub in subs:
+        css = sub(css)
+    return css
+
+
+def _rewrite_match(function, match):
+    """Return the replacement of a rule replaced by a function of the text."""
+    return function(match.group())
+
+
+def rewrite_css(css, rules=None):
+    """Apply all rewrite rules, the zero units and the registered ones."""
+    log.debug("Rewriting CSS with all the rewrite rules.")
+    return compile_rewrite_rules(rules or rewrite_rules())(css)
+
+
+def legacy_css_prettify(css, justify=False, group=False, timings=None):
+    """Prettify CSS running the whole string thru every regex step."""
+    log.info("Prettify CSS / SCSS using the Legacy pipeline...")
+    steps = (("sort_properties", partial(sort_properties, group=group)),
+             ("rewrite_css", rewrite_css),
+             ("wrap_css_lines", wrap_css_lines),
+             ("condense_semicolons", condense_semicolons),
+             ("normalize_whitespace", normalize_whitespace),
+             ("justify_right", justify_right if justify else None),
+             ("add_encoding", add_encoding))
+    for stage, step in steps:
+        if step is not None:
+            with timed(timings, stage):
+                css = step(css)
+    log.info("Finished Prettify CSS / SCSS !.")
+    return css
+
+
+###############################################################################
+# CSS Rules engine
+
+
+H_LINE = "/* {} */".format("-" * 72)
+LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+RE_ZERO_UNITS = re.compile(REWRITE_RULES["zero_units"][0])
+RE_SEMICOLONS = re.compile(r";;+")
+RE_EMPTY_RULES = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|"""
+                            r"""/\*.*?(?:\*/|\Z))|"""
+                            r"""(?<![^{};/])[^{};"'/]+\{\s*\}""", re.DOTALL)
+SPACE = r"(?:\s|/\*(?!!).*?(?:\*/|\Z))"  # Comments are just white space.
+RE_MINIFY = re.compile(r"""(/\*!.*?\*/)|"""
+                       r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|"""
+                       r"{0}*;{0}*(?=\}})|"
+                       r"{0}*([{{}}>;,]|:(?=[^{{}};]*[;}}])){0}*|"
+                       r"({0}+)".format(SPACE), re.DOTALL)
+RE_NESTING = re.compile(r"""/\*.*?(?:\*/|\Z)|"(?:\\.|[^"\\\n])*"|"""
+                        r"""'(?:\\.|[^'\\\n])*'|([{}])""", re.DOTALL)
+
+
+def _split_declarations(css, start, end):
+    """Split a rule body on the first new line after each semicolon."""
+    while start < end:
+        semicolon = css.find(";", start, end)
+        new_line = -1 if semicolon == -1 else css.find(
+            "\n", semicolon + 1, end)
+        stop = end if new_line == -1 else new_line + 1
+        declaration = css[start:stop].lstrip("\n")
+        if declaration.strip("\n "):
+            yield declaration
+        start = stop
+
+
+def _iter_sorted_rules(css, pgs):
+    """Yield the rules of css, Declarations sorted, scanning its braces.
+
+    A rule is everything up to the first '{', its body up to the next '}',
+    exactly like the Legacy pipeline splits it. Only the Declarations of
+    the body are sorted, the text before it goes as is.
+    """
+    position = 0
+    while True:
+        opening = css.find("{", position)
+        closing = css.find("}", opening + 1) if opening != -1 else -1
+        if closing == -1:
+            break
+        body = opening + 1
+        body += css.startswith("\r", body)
+        body += css.startswith("\n", body)
+        parts = [css[position:body]]
+        parts += _sorted_block(list(_split_declarations(css, body, closing)),
+                               pgs)
+        parts.append("}")
+        yield "".join(parts)
+        position = closing + 1
+    if position < len(css):
+        yield css[position:]
+
+
+def _iter_rewritten_rules(rules):
+    """Apply rewrite rules, every rule ends with '}' so no match spans 2."""
+    rewrite = compile_rewrite_rules(rewrite_rules())
+    for rule in rules:
+        yield rewrite(rule)
+
+
+def _iter_formatted_rules(css, group=False):
+    """Yield the rules sorted and rewritten, joined on batches of rules.
+
+    A batch also ends with '}', and the stages after the sort have a cost
+    per call, that lots of small rules would pay one by one.
+    """
+    return _iter_rewritten_rules(map("".join, _iter_batches(
+        _iter_sorted_rules(css, CSS_PGS[bool(group)]), RULES_BATCH)))
+
+
+def _iter_wrapped_rules(rules, line_length=80):
+    """Wrap lines to ~line_length and condense semicolons.
+
+    The wrap points are counted on the whole CSS thru position and
+    line_start, so rules may come in chunks of any number of rules.
+    """
+    position = line_start = 0
+    new_line = ""
+    for rule in rules:
+        pieces, cut = [new_line], 0
+        closing = rule.find("}", max(line_start + line_length - position, 0))
+        while closing != -1:
+            pieces += [rule[cut:closing + 1], "\n"]
+            cut = closing + 1
+            line_start = position + cut
+            closing = rule.find("}", cut + line_length)
+        if cut == len(rule):  # Its only a new line if something follows.
+            new_line = pieces.pop()
+        else:
+            new_line = ""
+            pieces.append(rule[cut:])
+        position += len(rule)
+        rule = "".join(pieces)
+        yield RE_SEMICOLONS.sub(";", rule) if ";;" in rule else rule
+
+
+def _iter_lines(chunks):
+    """Split chunks of text into lines, with the str.splitlines() rules."""
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).splitlines(True)
+        last = lines[-1] if lines else ""
+        if last[-1:] in ("", "\r") or last[-1] not in LINE_BREAKS:
+            pending = lines.pop() if lines else ""
+        else:
+            pending = ""
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def iter_normalized_lines(lines):
+    """Normalize white spaces of lines, a generator stage of lines.
+
+    Lines are rstripped, long runs of blank lines get a horizontal line,
+    spaces before ';' and '{' are fixed and a lonely '{' is moved up.
+    """
+    return _iter_braced_lines(_iter_collapsed_lines(lines))
+
+
+def _iter_collapsed_lines(lines):
+    """Rstrip lines, and replace runs of >6 new lines with a H_LINE."""
+    blanks, started = 0, False
+    for line in lines:
+        line = line.rstrip()
+        if not line:
+            blanks += 1
+            continue
+        if blanks:
+            for blank in _blank_run(blanks, started):
+                yield blank
+            blanks = 0
+        started = True
+        yield line
+    for blank in _blank_run(blanks, started):
+        yield blank
+
+
+def _blank_run(blanks, started):
+    """Return the blank lines to emit for a run, >6 new lines gets a H_LINE."""
+    if blanks >= (5 if started else 6):
+        return [""] * (4 if started else 5) + [H_LINE] + [""] * 4
+    return [""] * blanks
+
+
+def _iter_braced_lines(lines):
+    """Fix spaces before ';' and '{', moving lonely '{' to previous line."""
+    held, consumed, blanks = None, False, 0
+    for line in lines:
+        if not line:
+            blanks += 1
+            continue
+        matched = False
+        if line[-1] == ";":
+            if line.endswith(" ;"):
+                line = line[:-2] + ";"
+        elif line[-1] == "{":
+            line = line[:-1] + " {"
+            start = len(line) - 1
+            while start and line[start - 1].isspace():
+                start -= 1
+            if start:
+                matched = len(line) - 1 - start >= 2
+                line = line[:start] + " {" if matched else line
+            else:
+                joins = held is not None and not consumed
+                matched = blanks + joins + len(line) - 1 >= 2
+                if matched:
+                    line, blanks = " {", 0
+                    if joins:
+                        held, line = None, held + line
+        if held is not None:
+            yield held.replace("\t", "    ")
+        if blanks:
+            for _ in range(blanks):
+                yield ""
+            blanks = 0
+        held, consumed = line, matched
+    if held is not None:
+        yield held.replace("\t", "    ")
+    for _ in range(blanks):
+        yield ""
+
+
+def _justifiable(line):
+    """Return (name, value) if line is a property to justify, else None."""
+    name, colon, value = line.partition(":")
+    if (colon and ":" not in value and "{" not in line and "}" not in line
+            and line.strip().endswith(";")):
+        return name.rstrip(), value
+    return None
+
+
+def _max_indent(lines):
+    """Return the length of the longest property name of lines, plus 1."""
+    properties = filter(None, map(_justifiable, lines))
+    return max((len(name) + 1 for name, _ in properties), default=1)
+
+
+def _iter_justified(lines, max_indent):
+    """Yield lines, the properties justified to the Right to max_indent."""
+    for line in lines:
+        prop = _justifiable(line) if max_indent > 1 else None
+        if prop:
+            name, value = prop
+            line = name + ":" + " " * (max_indent - len(name)) + value.lstrip()
+        yield line
+
+
+def _justify_text(text, max_indent):
+    """Justify to the Right all properties of text, line by line."""
+    return _join_batches(_iter_justified(iter_text_lines(text), max_indent))
+
+
+def iter_justified_lines(lines):
+    """Justify to the Right all properties, a generator stage of lines.
+
+    The indentation depends on the longest property name of all the lines,
+    so lines are buffered, use justify_right() if the text is at hand.
+    """
+    lines = list(lines)
+    return _iter_justified(lines, _max_indent(lines))
+
+
+def iter_text_lines(text, size=65536):
+    """Yield the lines of text like str.splitlines(), without a full list."""
+    chunks = (text[start:start + size] for start in range(0, len(text), size))
+    for line in _iter_lines(chunks):
+        if line.endswith("\r\n"):
+            yield line[:-2]
+        elif line[-1] in LINE_BREAKS:
+            yield line[:-1]
         else:
-            right_justified_css += line_of_css + "\n"
-    return right_justified_css if max_indent > 1 else css
+            yield line
+
+
+def _iter_without_blank_tail(lines):
+    """Yield the lines, except the blank ones at the end."""
+    blanks = 0
+    for line in lines:
+        if not line:
+            blanks += 1
+            continue
+        for _ in range(blanks):
+            yield ""
+        blanks = 0
+        yield line
+
+
+def _iter_batches(lines, size=4096):
+    """Yield lists of up to size lines."""
+    lines = iter(lines)
+    batch = list(itertools.islice(lines, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(lines, size))
+
+
+def _join_batches(lines, size=4096):
+    """Join lines with new lines, joining in batches to keep few lines alive.
+
+    A single str.join() builds a list of all the lines first, the overhead
+    of a str object is often bigger than a line of CSS.
+    """
+    return "\n".join("\n".join(batch) for batch in _iter_batches(lines, size))
+
+
+def _join_lines(lines, justify=False):
+    """Join the lines back, Justify to the Right all properties if needed."""
+    pretty_css = _join_batches(_iter_without_blank_tail(lines))
+    if justify:
+        pretty_css = _justify_text(
+            pretty_css, _max_indent(iter_text_lines(pretty_css)))
+    return pretty_css + "\n\n"
+
+
+def _format_rules(css, group=False):
+    """Sort and rewrite, like zero units, the rules of a CSS chunk, Map phase.
+
+    Each rule is independent of the others, so a CSS split at the end of
+    any rule can be formatted in parallel and joined back together.
+    """
+    return "".join(_iter_formatted_rules(css, group))
+
+
+def _reduce_rules(chunks, css, justify=False):
+    """Wrap, normalize, justify and add encoding to the rules, Reduce phase."""
+    pretty_css = _join_lines(iter_normalized_lines(_iter_lines(
+        _iter_wrapped_rules(chunks))), justify=justify)
+    if "@charset" not in css:
+        pretty_css = "@charset utf-8;\n\n" + pretty_css
+    return pretty_css
+
+
+def split_css(css, chunk_size):
+    """Split CSS on chunks of about chunk_size at top level rule boundaries.
+
+    Chunks end right after a rule, as _iter_sorted_rules() ends it, and
+    outside of any comment, string or block like @media, if possible.
+    """
+    chunks, start, scanned, depth = [], 0, 0, 0
+    while len(css) - start > chunk_size:
+        split = start + chunk_size
+        while True:
+            opening = css.find("{", split)
+            closing = css.find("}", opening + 1) if opening != -1 else -1
+            split = len(css) if closing == -1 else closing + 1
+            for match in RE_NESTING.finditer(css, scanned, split):
+                depth += {"{": 1, "}": -1}.get(match.group(1), 0)
+            scanned = split
+            if depth <= 0 or split == len(css):
+                break
+        if split == len(css):
+            break
+        chunks.append(css[start:split])
+        start = split
+    chunks.append(css[start:])
+    return chunks
 
 
-def css_prettify(css, justify=False):
-    """Prettify CSS main function."""
+def parallel_css_prettify(css, justify=False, group=False, pool=None,
+                          chunk_size=None):
+    """Prettify one huge CSS splitting it on chunks formatted by a Pool.
+
+    The output is exactly the same as css_prettify() on a single process.
+    """
+    from multiprocessing import cpu_count, Pool
+    log.info("Prettify CSS / SCSS on parallel chunks...")
+    workers = cpu_count()
+    chunks = split_css(css, chunk_size or max(
+        len(css) // (workers * 4) + 1, 64 * 1024))
+    log.debug("Splitted CSS / SCSS in %s chunks.", len(chunks))
+    format_rules = partial(_format_rules, group=group)
+    if pool is not None:
+        pretty_css = _reduce_rules(pool.imap(format_rules, chunks), css,
+                                   justify=justify)
+    else:
+        pool = Pool(workers)
+        try:
+            pretty_css = _reduce_rules(pool.imap(format_rules, chunks), css,
+                                       justify=justify)
+        finally:
+            pool.close()
+            pool.join()
+    log.info("Finished Prettify CSS / SCSS !.")
+    return pretty_css
+
+
+def can_split():
+    """Return True if chunks of a CSS may go to a Pool of their own.
+
+    Pool workers can not have a Pool, and --threads workers run files in
+    parallel already, a Pool on each would start workers times CPUs
+    processes. On a single CPU chunks would only add overhead.
+    """
+    from multiprocessing import cpu_count, current_process
+    return (not current_process().daemon and cpu_count() > 1 and
+            threading.current_thread() is threading.main_thread())
+
+
+def css_prettify(css, justify=False, engine="rules", group=False,
+                 split_threshold=None, timings=None):
+    """Prettify CSS main function.
+
+    The Rules engine sorts and rewrites the CSS rule by rule, then formats
+    it while emitting lines, the Legacy engine runs each step on the whole
+    string, the Parallel engine formats chunks of the CSS on a Pool. All
+    produce exactly the same output, see --golden. The Rules engine switches
+    to Parallel for CSS longer than split_threshold characters, if
+    can_split().
+    If timings is a dict, the seconds spent on each stage are added to it.
+    """
+    if engine == "legacy":
+        return legacy_css_prettify(css, justify=justify, group=group,
+                                   timings=timings)
+    if engine == "parallel" or (
+            split_threshold and len(css) >= split_threshold and can_split()):
+        with timed(timings, "parallel_css_prettify"):
+            return parallel_css_prettify(css, justify=justify, group=group)
     log.info("Prettify CSS / SCSS...")
-    css = sort_properties(css)
-    css = condense_zero_units(css)
-    css = wrap_css_lines(css, 80)
-    css = condense_semicolons(css)
-    css = normalize_whitespace(css)
-    css = justify_right(css) if justify else css
-    css = add_encoding(css)
+    rules = _iter_formatted_rules(css, group)
+    if timings is not None:  # Stages run interleaved, unless timed apart.
+        with timed(timings, "format_rules"):
+            rules = ("".join(rules), )
+    with timed(timings, "reduce_rules"):
+        pretty_css = _reduce_rules(rules, css, justify=justify)
     log.info("Finished Prettify CSS / SCSS !.")
-    return css
+    return pretty_css
+
+
+def _iter_rule_chunks(texts, chunk_size):
+    """Join pieces of text and split them again at rule boundaries."""
+    pending, size, threshold = [], 0, chunk_size
+    for text in texts:
+        pending.append(text)
+        size += len(text)
+        if size < threshold:
+            continue
+        chunks = split_css("".join(pending), chunk_size)
+        pending = [chunks.pop()]
+        size = len(pending[0])
+        threshold = max(chunk_size, 2 * size)  # Dont rescan a long rule.
+        for chunk in chunks:
+            yield chunk
+    yield "".join(pending)
+
+
+def iter_css_prettify(texts, group=False, chunk_size=STREAM_SIZE):
+    """Prettify CSS coming in pieces of text, yield the output rule by rule.
+
+    Memory is bounded by chunk_size and the longest rule, not by the whole
+    CSS. The output is the same as css_prettify(), but there is no justify,
+    it needs all the properties first, and '@charset' is only searched on
+    the first chunk, where CSS requires it to be.
+    """
+    chunks = _iter_rule_chunks(texts, chunk_size)
+    first = next(chunks)
+    if "@charset" not in first:
+        yield "@charset utf-8;\n\n"
+    rules = map(partial(_format_rules, group=group),
+                itertools.chain((first, ), chunks))
+    lines = _iter_without_blank_tail(iter_normalized_lines(_iter_lines(
+        _iter_wrapped_rules(rules))))
+    ended = "\n\n"
+    for batch in _iter_batches(lines):
+        yield "\n".join(batch) + "\n"
+        ended = "\n"
+    yield ended
+
+
+def _minify(css):
+    """Minify rules, all comments and white space go, except /*! ones.
+
+    Strings are kept as is, and the ':' only loses its spaces on
+    Declarations, since on selectors like 'a :hover' they matter. Rules
+    are split on braces even inside comments, so they are minified all
+    joined, never one by one.
+    """
+    if ";;" in css:
+        css = RE_SEMICOLONS.sub(";", css)
+    return RE_MINIFY.sub(_minified_match, css).strip()
+
+
+def _minified_match(match):
+    """Return what is left of a RE_MINIFY match, by its group."""
+    if match.lastindex is None:  # Last semicolons of blocks.
+        return ""
+    return " " if match.lastindex == 4 else match.group(match.lastindex)
+
+
+def _iter_minifying_rules(rules, collected):
+    """Yield the rules as they come, appending them to collected."""
+    for rule in rules:
+        collected.append(rule)
+        yield rule
+
+
+def css_minify(css, group=False):
+    """Minify CSS, from the same sorted and zero condensed rules as pretty.
+
+    Comments except /*! ones, white space, repeated and last semicolons of
+    blocks, and empty rules are removed, strings are kept as is.
+    """
+    log.info("Minify CSS / SCSS...")
+    rules = _iter_formatted_rules(css, group)
+    return remove_empty_rules(_minify("".join(rules)))
+
+
+def css_prettify_and_minify(css, justify=False, group=False):
+    """Return the pretty and the minified CSS, sorting the rules only once.
+
+    Each rule is collected as the pretty CSS consumes it, then minified,
+    so this returns exactly the same as css_prettify() and css_minify().
+    """
+    log.info("Prettify and Minify CSS / SCSS...")
+    collected = []
+    rules = _iter_minifying_rules(_iter_formatted_rules(css, group),
+                                  collected)
+    pretty_css = _reduce_rules(rules, css, justify=justify)
+    return pretty_css, remove_empty_rules(_minify("".join(collected)))
+
+
+def golden_compare(css, justify=False, group=False):
+    """Compare Rules engine output versus Legacy output, the golden one.
+
+    Return the index of the first different character, or -1 if identical.
+    """
+    golden = legacy_css_prettify(css, justify=justify, group=group)
+    pretty_css = css_prettify(css, justify=justify, group=group)
+    if golden == pretty_css:
+        return -1
+    for index, (expected, actual) in enumerate(zip(golden, pretty_css)):
+        if expected != actual:
+            return index
+    return min(len(golden), len(pretty_css))
 
 
 ##############################################################################
@@ -315,24 +968,190 @@ def css_prettify(css, justify=False):
 
 
 # http://stackoverflow.com/a/15513483
-orig_prettify = BeautifulSoup.prettify
 regez = re.compile(r'^(\s*)', re.MULTILINE)
 
 
-def prettify(self, encoding=None, formatter="minimal", indent_width=4):
-    """Monkey Patch the BS4 prettify to allow custom indentations."""
-    log.debug("Monkey Patching BeautifulSoup on-the-fly to process HTML...")
-    return regez.sub(r'\1' * indent_width,
-                     orig_prettify(self, encoding, formatter))
+def prettify(soup, encoding=None, formatter="minimal", indent_width=4):
+    """BS4 prettify with custom indentations, without Monkey Patching BS4."""
+    return regez.sub(r'\1' * indent_width, soup.prettify(encoding, formatter))
+
+
+VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "command", "embed", "hr", "img", "input",
+    "keygen", "link", "meta", "param", "source", "track", "wbr"))
+RAW_ELEMENTS = frozenset(("pre", "script", "style", "textarea"))
+RE_MS_SECTION = re.compile(  # Marked sections closed by ]> not by ]]>.
+    r"(?:if|else|endif)(?![-.\w])", re.IGNORECASE)
+IMPLIED_END_ELEMENTS = dict.fromkeys((  # Start tags closing open elements.
+    "address", "article", "aside", "blockquote", "div", "dl", "fieldset",
+    "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr",
+    "main", "nav", "ol", "p", "pre", "section", "table", "ul"), ("p", ))
+IMPLIED_END_ELEMENTS.update({
+    "li": ("li", ), "option": ("option", ), "dt": ("dt", "dd"),
+    "dd": ("dt", "dd"), "tr": ("tr", "td", "th"), "td": ("td", "th"),
+    "th": ("td", "th")})
 
-BeautifulSoup.prettify = prettify
 
+class HTMLStreamFormatter(object):
+    """Indent HTML as its tags arrive, thru the standard library html.parser.
 
-def html_prettify(html):
-    """Prettify HTML main function."""
-    log.info("Prettify HTML...")
-    html = BeautifulSoup(html).prettify()
-    html = html.replace("\t", "    ").rstrip("\n") + "\n\n"
+    Each tag, text and comment goes on its own line indented by its depth,
+    like BS4 prettify does. Void elements do not indent, the content of
+    RAW_ELEMENTS is written untouched, start tags are written as found.
+    """
+
+    def __init__(self, indent=4):
+        from html.parser import HTMLParser
+        self.parser = HTMLParser(convert_charrefs=False)
+        for event in ("starttag", "startendtag", "endtag", "data", "comment",
+                      "entityref", "charref", "decl", "pi"):
+            handler = "handle_" + event
+            setattr(self.parser, handler, getattr(self, handler))
+        # Marked sections like CDATA go to unknown_decl(), not a handle_ one.
+        self.parser.unknown_decl = self.handle_unknown_decl
+        self.indent, self.stack, self.text, self.output = indent, [], [], []
+        self.raw, self.raw_depth = None, 0
+
+    def feed(self, html):
+        """Feed a piece of HTML, return the output formatted so far."""
+        self.parser.feed(html)
+        return self._pop_output()
+
+    def close(self):
+        """Finish the HTML, return the rest of the output."""
+        self.parser.close()
+        self._write_text()
+        return self._pop_output()
+
+    def _pop_output(self):
+        output, self.output = "".join(self.output), []
+        return output
+
+    def _write_line(self, line):
+        self.output += [" " * self.indent * len(self.stack), line, "\n"]
+
+    def _write_text(self):
+        text, self.text = "".join(self.text), []
+        for line in text.splitlines():  # Re-indent each line of the text.
+            line = line.strip()
+            if line:
+                self._write_line(line)
+
+    def _write(self, text):
+        if self.raw:
+            self.output.append(text)
+        else:
+            self.text.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        starttag = self.parser.get_starttag_text()
+        if self.raw:
+            self.raw_depth += tag == self.raw
+            self.output.append(starttag)
+            return
+        self._write_text()
+        while self.stack and self.stack[-1] in IMPLIED_END_ELEMENTS.get(
+                tag, ()):
+            self.stack.pop()  # Like <li> closing the previous <li>.
+        if tag in RAW_ELEMENTS:
+            self.output += [" " * self.indent * len(self.stack), starttag]
+            self.raw, self.raw_depth = tag, 1
+        else:
+            self._write_line(starttag)
+            if tag not in VOID_ELEMENTS:
+                self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self.raw:
+            self.output.append(self.parser.get_starttag_text())
+        else:
+            self._write_text()
+            self._write_line(self.parser.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        endtag = "</{}>".format(tag)
+        if self.raw:
+            self.raw_depth -= tag == self.raw
+            self.output.append(endtag)
+            if not self.raw_depth:
+                self.output.append("\n")
+                self.raw = None
+            return
+        if tag in VOID_ELEMENTS:  # Like </img>, void elements have no end.
+            return
+        self._write_text()
+        if tag in self.stack:  # Close the elements left open inside it.
+            del self.stack[len(self.stack) - self.stack[::-1].index(tag) - 1:]
+        self._write_line(endtag)
+
+    def handle_data(self, data):
+        self._write(data)
+
+    def handle_entityref(self, name):
+        self._write("&{};".format(name))
+
+    def handle_charref(self, name):
+        self._write("&#{};".format(name))
+
+    def handle_comment(self, data):
+        if self.raw:
+            self.output.append("<!--{}-->".format(data))
+        else:
+            self._write_text()
+            self._write_line("<!--{}-->".format(data))
+
+    def handle_decl(self, decl):
+        self._write_text()
+        self._write_line("<!{}>".format(decl))
+
+    def handle_pi(self, data):
+        self._write_text()
+        self._write_line("<?{}>".format(data))
+
+    def handle_unknown_decl(self, data):
+        section = "<![{}{}".format(data, "]>" if RE_MS_SECTION.match(
+            data) else "]]>")
+        if self.raw:
+            self.output.append(section)
+        else:
+            self._write_text()
+            self._write_line(section)
+
+
+def iter_html_prettify(texts, indent=4):
+    """Prettify HTML coming in pieces of text, yield the output as it goes."""
+    formatter, written = HTMLStreamFormatter(indent), False
+    for html in texts:
+        pretty_html = formatter.feed(html)
+        if pretty_html:
+            written = True
+            yield pretty_html
+    pretty_html = formatter.close()
+    yield pretty_html + ("\n" if written or pretty_html else "\n\n")
+
+
+def html_prettify(html, indent=4, engine="stream", parser="html.parser",
+                  timings=None):
+    """Prettify HTML main function.
+
+    The Stream engine indents tags as they arrive thru html.parser, the BS4
+    engine builds a whole tree with the BeautifulSoup parser given, slower
+    but the same output as previous versions.
+    If timings is a dict, the seconds spent on each stage are added to it.
+    """
+    if engine == "bs4":
+        from bs4 import BeautifulSoup
+        log.info("Prettify HTML using BS4 with %s...", parser)
+        with timed(timings, "parse_html"):
+            soup = BeautifulSoup(html, parser)
+        with timed(timings, "prettify_html"):
+            html = prettify(soup, indent_width=indent)
+            html = html.replace("\t", "    ").rstrip("\n") + "\n\n"
+        soup.decompose()  # Tags link each other, free them without the gc.
+    else:
+        log.info("Prettify HTML...")
+        with timed(timings, "stream_html"):
+            html = "".join(iter_html_prettify((html, ), indent=indent))
     log.info("Finished prettify HTML !.")
     return html
 
@@ -340,98 +1159,1585 @@ def html_prettify(html):
 ##############################################################################
 
 
-def walkdir_to_filelist(where, target, omit):
+IGNORE_FILES = (".gitignore", ".prettifyignore")
+EXCLUDE = ("node_modules", )  # Folders never walked, besides hidden ones.
+
+
+def walkdir_to_filelist(where, target, omit, prefix=None, exclude=()):
     """Perform full walk of where, gather full path of all files."""
-    log.debug("""Recursively Scanning {}, searching for {}, and ignoring {}.
-    """.format(where, target, omit))
-    return tuple([os.path.join(root, f) for root, d, files in os.walk(where)
-                  for f in files if not f.startswith('.')  # ignore hidden
-                  and not f.endswith(omit)  # not process processed file
-                  and f.endswith(target)])  # only process target files
-
-
-def process_multiple_files(file_path):
-    """Process multiple CSS, HTML files with multiprocessing."""
-    log.debug("Process {} is Compressing {}.".format(os.getpid(), file_path))
-    if args.watch:
-        previous = int(os.stat(file_path).st_mtime)
-        log.info("Process {} is Watching {}.".format(os.getpid(), file_path))
-        while True:
-            actual = int(os.stat(file_path).st_mtime)
-            if previous == actual:
-                sleep(60)
-            else:
-                previous = actual
-                log.debug("Modification detected on {}.".format(file_path))
-                if file_path.endswith((".css", ".scss")):
-                    process_single_css_file(file_path)
-                else:
-                    process_single_html_file(file_path)
+    return tuple(iter_target_files(where, target, omit, prefix, exclude))
+
+
+def is_target_file(file_name, target, omit, prefix=None, exists=None):
+    """Return True if the file name should be processed.
+
+    A name that starts with the prefix is only taken as our output if
+    exists() of the name without it is True, a file on the same folder,
+    so inputs like publicidad.css for the prefix p are still processed.
+    """
+    return (not file_name.startswith('.')  # ignore hidden
+            and not file_name.endswith(omit)  # not process processed file
+            and not (prefix and exists and file_name.startswith(prefix) and
+                     exists(file_name[len(prefix):]))  # our output
+            and file_name.endswith(target))  # only process target files
+
+
+def read_ignore_rules(folder, relative_folder, ignore_files=IGNORE_FILES):
+    """Return the rules of the ignore files of a folder, like .gitignore.
+
+    Rules are (pattern, anchored, negated, folders_only) tuples, anchored
+    patterns match the path relative to the walk root, others the name.
+    """
+    rules = []
+    for ignore_file in ignore_files:
+        try:
+            with open(os.path.join(folder, ignore_file),
+                      encoding="utf-8") as ignore:
+                lines = ignore.read().splitlines()
+        except (IOError, OSError, UnicodeDecodeError):
+            continue
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            line = line[negated:]
+            folders_only = line.endswith("/")
+            line = line.rstrip("/")
+            if line.startswith("**/"):  # Same as not anchored at all.
+                line = line[3:]
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if anchored and relative_folder:
+                line = relative_folder + "/" + line
+            rules.append((line, anchored, negated, folders_only))
+    return rules
+
+
+def is_ignored(name, relative_path, is_folder, rules):
+    """Return True if the rules ignore a file or folder, the last one wins."""
+    ignored = False
+    for pattern, anchored, negated, folders_only in rules:
+        if (is_folder or not folders_only) and fnmatchcase(
+                relative_path if anchored else name, pattern):
+            ignored = not negated
+    return ignored
+
+
+def is_pruned(name, relative_path, rules):
+    """Return True if a folder is not walked, hidden or ignored by rules."""
+    return name.startswith(".") or is_ignored(name, relative_path, True,
+                                              rules)
+
+
+def relative_to(relative_folder, name):
+    """Return the path of name relative to the walk root, with slashes."""
+    return relative_folder + "/" + name if relative_folder else name
+
+
+def walk_folders(where, exclude=(), ignore_files=IGNORE_FILES,
+                 relative_folder="", rules=None):
+    """Walk where with scandir, yield each folder not pruned, depth first.
+
+    Yield (folder, relative folder, rules, entries sorted by name), rules
+    apply to its entries, those of the folder and the ones above it, or
+    rules if given, the ones above where. Hidden folders, EXCLUDE and
+    exclude globs are pruned, and so is all ignored by the ignore files of
+    each folder, like .gitignore. Files are left to the caller.
+    """
+    if rules is None:
+        rules = [(pattern.strip("/"), "/" in pattern.strip("/"), False,
+                  False) for pattern in EXCLUDE + tuple(exclude)]
+    folders = [(where, relative_folder, rules)]
+    while folders:
+        folder, relative_folder, rules = folders.pop()
+        rules = rules + read_ignore_rules(folder, relative_folder,
+                                          ignore_files)
+        try:
+            entries = sorted(os.scandir(folder), key=lambda entry: entry.name)
+        except OSError as error:
+            log.warning("Can not scan %s: %s.", folder, error)
+            continue
+        yield folder, relative_folder, rules, entries
+        subfolders = []
+        for entry in entries:
+            relative_path = relative_to(relative_folder, entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=False) and not is_pruned(
+                        entry.name, relative_path, rules):
+                    subfolders.append((entry.path, relative_path, rules))
+            except OSError:
+                continue  # Deleted or not readable while scanning.
+        folders += reversed(subfolders)  # Walk them in order, depth first.
+
+
+def iter_target_files(where, target, omit, prefix=None, exclude=(),
+                      ignore_files=IGNORE_FILES):
+    """Walk where with scandir, yield the files to process as found.
+
+    Folders are pruned like walk_folders(), files ignored by its rules are
+    skipped, and so are outputs of the prefix next to its input.
+    """
+    log.debug("Recursively Scanning %s, searching for %s, and ignoring %s.",
+              where, target, omit)
+    for _, relative_folder, rules, entries in walk_folders(
+            where, exclude, ignore_files):
+        names = set(entry.name for entry in entries)
+        for entry in entries:
+            try:
+                if (is_target_file(entry.name, target, omit, prefix,
+                                   names.__contains__)
+                        and entry.is_file() and not is_ignored(
+                            entry.name, relative_to(relative_folder,
+                                                    entry.name),
+                            False, rules)):
+                    yield entry.path
+            except OSError:
+                continue  # Deleted or not readable while scanning.
+
+
+def cache_key(text, kind, options):
+    """Return the cache key of text, hashed with all options that affect it."""
+    import hashlib
+    options = (kind, bool(options.group), bool(options.justify),
+               options.prefix or "", bool(options.timestamp), options.indent,
+               options.html_engine, options.html_parser, __version__,
+               [(pattern, getattr(replacement, "__qualname__", replacement))
+                for pattern, replacement in rewrite_rules()])
+    hashed = hashlib.sha256(repr(options).encode("utf-8") + b"\0")
+    hashed.update(text.encode("utf-8"))
+    return hashed.hexdigest()
+
+
+def cache_get(key, cache_dir):
+    """Return the cached output for key or None, mark it as recently used."""
+    cache_entry_path = os.path.join(cache_dir, key)
+    try:
+        with open(cache_entry_path, encoding="utf-8") as cache_entry:
+            cached = cache_entry.read()
+    except (IOError, OSError):
+        return None
+    try:
+        os.utime(cache_entry_path, None)  # LRU uses mtime as last used time.
+    except (IOError, OSError):
+        pass  # A read only cache still hits.
+    return cached
+
+
+def cache_writable(options):
+    """Return True if the cache is written, never on --check or --diff.
+
+    Lint runs only read it, so they leave no trace on CI.
+    """
+    return options.cache and not (options.check or options.diff)
+
+
+def cache_set(key, output, cache_dir):
+    """Store output for key on the cache, written atomically."""
+    cache_entry_path = os.path.join(cache_dir, key)
+    temp_path = "{}.{}.{}.tmp".format(
+        cache_entry_path, os.getpid(), threading.get_ident())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as cache_entry:
+            cache_entry.write(output)
+        os.replace(temp_path, cache_entry_path)
+    except (IOError, OSError) as error:
+        log.warning("Can not write to the cache: %s.", error)
+
+
+def cache_evict(cache_dir, max_size):
+    """Delete the least recently used cache entries until under max_size."""
+    try:
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                   for entry in os.scandir(cache_dir) if entry.is_file()]
+    except (IOError, OSError):
+        return 0
+    total_size, evicted = sum(entry[1] for entry in entries), 0
+    for _, size, cache_entry_path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(cache_entry_path)
+        except (IOError, OSError):
+            continue
+        total_size -= size
+        evicted += 1
+    log.debug("Evicted %s entries from the cache on %s.", evicted, cache_dir)
+    return evicted
+
+
+def process_multiple_files(file_path, options=Options()):
+    """Process multiple CSS, HTML files with multiprocessing.
+
+    With a profile_dir on options, each file is run under cProfile and its
+    stats dumped there, the path of the dump goes on the file metrics.
+    """
+    log.debug("Process %s is Compressing %s.", os.getpid(), file_path)
+    if file_path.endswith((".css", ".scss")):
+        process = process_single_css_file
     else:
-        if file_path.endswith((".css", ".scss")):
-            process_single_css_file(file_path)
-        else:
-            process_single_html_file(file_path)
+        process = process_single_html_file
+    if not options.profile_dir:
+        return process(file_path, options)
+    import cProfile
+    profiler = cProfile.Profile()
+    result = profiler.runcall(process, file_path, options)
+    if result.metrics is not None:
+        profile_path = os.path.join(options.profile_dir, "{}-{}.prof".format(
+            os.getpid(), next(PROFILE_IDS)))
+        profiler.dump_stats(profile_path)
+        result.metrics["profile"] = profile_path
+    return result
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the time spent on the with block to timings[stage], if timings."""
+    if timings is None:
+        yield
+        return
+    started = monotonic()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + monotonic() - started
+
+
+def new_metrics(file_path, kind, options):
+    """Return a dict to collect the metrics of a file, None if no profile."""
+    if not options.profile:
+        return None
+    return {"path": file_path, "kind": kind, "pid": os.getpid(),
+            "bytes_in": os.path.getsize(file_path), "stages": {},
+            "started": monotonic()}
+
+
+def finish_metrics(metrics, cache_status, output_file_path):
+    """Complete the metrics of a file once its written, return them."""
+    if metrics is not None:
+        metrics.update(cache=cache_status, bytes_out=os.path.getsize(
+            output_file_path) if os.path.exists(output_file_path) else 0,
+                       seconds=monotonic() - metrics.pop("started"))
+    return metrics
 
 
-def prefixer_extensioner(file_path):
+def prefixer_extensioner(file_path, prefix=None):
     """Take a file path and safely prepend a prefix and change extension.
 
     This is needed because filepath.replace('.foo', '.bar') sometimes may
     replace '/folder.foo/file.foo' into '/folder.bar/file.bar' wrong!.
     """
-    log.debug("Prepending '{}' Prefix to {}.".format(args.prefix, file_path))
+    log.debug("Prepending '%s' Prefix to %s.", prefix, file_path)
     extension = os.path.splitext(file_path)[1].lower()
     filenames = os.path.splitext(os.path.basename(file_path))[0]
-    filenames = args.prefix + filenames if args.prefix else filenames
+    filenames = prefix + filenames if prefix else filenames
     dir_names = os.path.dirname(file_path)
     file_path = os.path.join(dir_names, filenames + extension)
     return file_path
 
 
-def process_single_css_file(css_file_path):
-    """Process a single CSS file."""
-    log.info("Processing CSS / SCSS file: {}".format(css_file_path))
-    global args
-    try:  # Python3
-        with open(css_file_path, encoding="utf-8-sig") as css_file:
-            original_css = css_file.read()
-    except:  # Python2
-        with open(css_file_path) as css_file:
-            original_css = css_file.read()
-    pretty_css = css_prettify(original_css, justify=args.justify)
-    if args.timestamp:
-        taim = "/* {} */ ".format(datetime.now().isoformat()[:-7].lower())
-        pretty_css = taim + pretty_css
-    min_css_file_path = prefixer_extensioner(css_file_path)
+def minified_file_path(file_path):
+    """Return the path of the minified copy of file_path, like foo.min.css."""
+    root, extension = os.path.splitext(file_path)
+    return root + ".min" + extension
+
+
+def timestamp_comment():
+    """Return a CSS comment with the current Time Stamp."""
+    return "/* {} */ ".format(datetime.now().isoformat()[:-7].lower())
+
+
+def write_atomic(file_path, data):
+    """Write data Bytes to file_path thru a temporary file renamed over it.
+
+    Readers never see a half written file, and its permissions are kept.
+    A symlink is written thru, renamed over its target, not replaced.
+    """
+    file_path = os.path.realpath(file_path)
+    temp_path = "{}.{}.{}.tmp".format(
+        file_path, os.getpid(), threading.get_ident())
     try:
-        with open(min_css_file_path, "w", encoding="utf-8") as output_file:
-            output_file.write(pretty_css)
-    except:
-        with open(min_css_file_path, "w") as output_file:
-            output_file.write(pretty_css)
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(data)
+        if os.path.exists(file_path):
+            os.chmod(temp_path, os.stat(file_path).st_mode & 0o7777)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def has_content(file_path, data):
+    """Return True if the file at file_path has exactly data Bytes."""
+    try:
+        with open(file_path, "rb") as old_file:
+            return (os.fstat(old_file.fileno()).st_size == len(data) and
+                    old_file.read() == data)
+    except (IOError, OSError):
+        return False
 
 
-def process_single_html_file(html_file_path):
-    """Process a single HTML file."""
-    log.info("Processing HTML file: {}".format(html_file_path))
-    try:  # Python3
-        with open(html_file_path, encoding="utf-8-sig") as html_file:
-            pretty_html = html_prettify(html_file.read())
-    except:  # Python2
-        with open(html_file_path) as html_file:
-            pretty_html = html_prettify(html_file.read())
-    html_file_path = prefixer_extensioner(html_file_path)
+def unified_diff(old_text, new_text, file_path):
+    """Return an unified diff of old_text versus new_text, for file_path."""
+    from difflib import unified_diff as diff_lines
+    return "".join(line if line.endswith("\n") else
+                   line + "\n\\ No newline at end of file\n"
+                   for line in diff_lines(
+                       old_text.splitlines(True), new_text.splitlines(True),
+                       "a/" + file_path.lstrip("/"),
+                       "b/" + file_path.lstrip("/")))
+
+
+def write_if_changed(file_path, text, options=Options()):
+    """Write text to file_path only if its content is different.
+
+    With check or diff on options nothing is written at all.
+    Return (changed, diff), diff is an unified diff only if options.diff.
+    """
+    data = text.encode("utf-8")
+    if has_content(file_path, data):
+        log.debug("Unchanged, not written: %s.", file_path)
+        return False, None
+    diff = None
+    if options.diff:
+        try:
+            with open(file_path, encoding="utf-8", errors="replace") as old:
+                old_text = old.read()
+        except (IOError, OSError):
+            old_text = ""  # New file.
+        diff = unified_diff(old_text, text, file_path)
+    if not options.check and not options.diff:
+        write_atomic(file_path, data)
+    return True, diff
+
+
+def can_stream(options, kind="css"):
+    """Return True if kind can be processed as it is read, with options."""
+    if options.diff or options.minify:  # They need the whole output.
+        return False
+    if kind == "html":
+        return options.stream and options.html_engine == "stream"
+    return options.stream and not options.justify and not options.golden
+
+
+def stream_text(texts, output_file, kind="css", options=Options()):
+    """Prettify CSS or HTML coming in pieces of text, writing as it goes."""
+    if kind == "html":
+        pretty_texts = iter_html_prettify(texts, indent=options.indent)
+    else:
+        if options.timestamp:
+            output_file.write(timestamp_comment())
+        pretty_texts = iter_css_prettify(texts, group=options.group)
+    for pretty_text in pretty_texts:
+        output_file.write(pretty_text)
+
+
+def stream_single_file(file_path, kind="css", options=Options()):
+    """Process a single CSS or HTML file as it is read, with bounded memory.
+
+    Its written to a temporary file renamed over the output at the end,
+    since without a prefix the output file is the input file itself, and
+    only if its different, if options.check its never renamed. A symlink
+    is written thru, the temporary file is renamed over its target.
+    """
+    log.info("Streaming %s file: %s", kind.upper(), file_path)
+    from filecmp import cmp
+    metrics = new_metrics(file_path, kind, options)
+    output_file_path = prefixer_extensioner(file_path, options.prefix)
+    real_path = os.path.realpath(output_file_path)
+    temp_path = "{}.{}.tmp".format(real_path, os.getpid())
+    try:
+        with timed(metrics and metrics["stages"], "stream"):
+            with open(file_path, encoding="utf-8-sig") as input_file:
+                with open(temp_path, "w", encoding="utf-8") as output_file:
+                    stream_text(iter(partial(
+                        input_file.read, STREAM_SIZE), ""),
+                        output_file, kind, options)
+            changed = not (os.path.exists(real_path) and cmp(
+                temp_path, real_path, shallow=False))
+            if changed and not options.check:
+                if os.path.exists(real_path):
+                    os.chmod(temp_path, os.stat(real_path).st_mode & 0o7777)
+                os.replace(temp_path, real_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return Result(True, CACHE_MISS, finish_metrics(
+        metrics, CACHE_MISS, output_file_path), changed=changed)
+
+
+def read_text(file_path):
+    """Return the text of a file, UTF-8 with or without BOM."""
     try:  # Python3
-        with open(html_file_path, "w", encoding="utf-8") as output_file:
-            output_file.write(pretty_html)
+        with open(file_path, encoding="utf-8-sig") as text_file:
+            return text_file.read()
     except:  # Python2
-        with open(html_file_path, "w") as output_file:
-            output_file.write(pretty_html)
+        with open(file_path) as text_file:
+            return text_file.read()
+
+
+def write_outputs(outputs, options=Options()):
+    """Write (path, text) outputs that changed, return (changed, diff)."""
+    changed, diffs = False, []
+    for output_file_path, text in outputs:
+        output_changed, diff = write_if_changed(output_file_path, text,
+                                                options)
+        changed = changed or output_changed
+        diffs.append(diff or "")
+    return changed, "".join(diffs) or None
+
+
+def finish_file(prettified, options=Options()):
+    """Write the outputs of a Prettified file, return its Result."""
+    metrics = prettified.metrics
+    if not prettified.ok:
+        return Result(False, prettified.cache_status, metrics)
+    with timed(metrics and metrics["stages"], "write"):
+        changed, diff = write_outputs(prettified.outputs, options)
+    return Result(True, prettified.cache_status, finish_metrics(
+        metrics, prettified.cache_status, prettified.outputs[0][0]),
+        changed=changed, diff=diff)
+
+
+def prettify_file_text(file_path, text, kind="css", options=Options(),
+                       metrics=None):
+    """Prettify the text read from a CSS or HTML file, without any I/O.
+
+    Only the cache is read and written, return a Prettified with the
+    (path, text) outputs to write, by finish_file().
+    """
+    if kind == "html":
+        return prettify_html_text(file_path, text, options, metrics)
+    return prettify_css_text(file_path, text, options, metrics)
+
+
+def process_single_css_file(css_file_path, options=Options()):
+    """Process a single CSS file."""
+    if can_stream(options):
+        return stream_single_file(css_file_path, "css", options)
+    log.info("Processing CSS / SCSS file: %s", css_file_path)
+    metrics = new_metrics(css_file_path, "css", options)
+    with timed(metrics and metrics["stages"], "read"):
+        original_css = read_text(css_file_path)
+    return finish_file(prettify_css_text(
+        css_file_path, original_css, options, metrics), options)
+
+
+def prettify_css_text(css_file_path, original_css, options=Options(),
+                      metrics=None):
+    """Prettify the text of a CSS file, and minify it if options.minify."""
+    timings = metrics and metrics["stages"]
+    use_cache = options.cache and not options.golden
+    store = use_cache and cache_writable(options)
+    with timed(timings, "cache"):
+        key = cache_key(original_css, "css", options) if use_cache else None
+        pretty_css = cache_get(key, options.cache_dir) if use_cache else None
+    cache_status = CACHE_HIT if pretty_css is not None else CACHE_MISS
+    minify = options.minify and css_file_path.endswith(".css")
+    minified_css = None
+    if minify and use_cache:
+        with timed(timings, "cache"):
+            min_key = cache_key(original_css, "css.min", options)
+            minified_css = cache_get(min_key, options.cache_dir)
+    if pretty_css is None and minify and minified_css is None:
+        with timed(timings, "css_prettify_and_minify"):
+            pretty_css, minified_css = css_prettify_and_minify(
+                original_css, justify=options.justify, group=options.group)
+        if store:
+            with timed(timings, "cache"):
+                cache_set(key, pretty_css, options.cache_dir)
+                cache_set(min_key, minified_css, options.cache_dir)
+    if pretty_css is None:
+        pretty_css = css_prettify(original_css, justify=options.justify,
+                                  group=options.group,
+                                  split_threshold=options.split_threshold,
+                                  timings=timings)
+        if store:
+            with timed(timings, "cache"):
+                cache_set(key, pretty_css, options.cache_dir)
+    if minify and minified_css is None:
+        with timed(timings, "css_minify"):
+            minified_css = css_minify(original_css, group=options.group)
+        if store:
+            with timed(timings, "cache"):
+                cache_set(min_key, minified_css, options.cache_dir)
+    if options.golden:
+        with timed(timings, "golden"):
+            index = golden_compare(original_css, justify=options.justify,
+                                   group=options.group)
+        if index != -1:
+            log.error("Golden comparison failed on %s at character %s.",
+                      css_file_path, index)
+            return Prettified(False, cache_status, metrics, [])
+        log.info("Golden comparison passed on %s.", css_file_path)
+    if options.timestamp:
+        pretty_css = timestamp_comment() + pretty_css
+    min_css_file_path = prefixer_extensioner(css_file_path, options.prefix)
+    outputs = [(min_css_file_path, pretty_css)]
+    if minify:
+        outputs.append((minified_file_path(min_css_file_path), minified_css))
+    return Prettified(True, cache_status, metrics, outputs)
+
+
+def process_single_html_file(html_file_path, options=Options()):
+    """Process a single HTML file."""
+    if can_stream(options, "html"):
+        return stream_single_file(html_file_path, "html", options)
+    log.info("Processing HTML file: %s", html_file_path)
+    metrics = new_metrics(html_file_path, "html", options)
+    with timed(metrics and metrics["stages"], "read"):
+        original_html = read_text(html_file_path)
+    return finish_file(prettify_html_text(
+        html_file_path, original_html, options, metrics), options)
+
+
+def prettify_html_text(html_file_path, original_html, options=Options(),
+                       metrics=None):
+    """Prettify the text of a HTML file."""
+    timings = metrics and metrics["stages"]
+    with timed(timings, "cache"):
+        key = pretty_html = None
+        if options.cache:
+            key = cache_key(original_html, "html", options)
+            pretty_html = cache_get(key, options.cache_dir)
+    cache_status = CACHE_HIT if pretty_html is not None else CACHE_MISS
+    if pretty_html is None:
+        pretty_html = html_prettify(
+            original_html, indent=options.indent, engine=options.html_engine,
+            parser=options.html_parser, timings=timings)
+        if cache_writable(options):
+            with timed(timings, "cache"):
+                cache_set(key, pretty_html, options.cache_dir)
+    html_file_path = prefixer_extensioner(html_file_path, options.prefix)
+    return Prettified(True, cache_status, metrics,
+                      [(html_file_path, pretty_html)])
+
+
+def guess_kind(text):
+    """Return 'html' if text looks like HTML, else 'css'."""
+    return "html" if text.lstrip().startswith("<") else "css"
+
+
+def process_stdin(options=Options()):
+    """Process StdIn to StdOut, both as UTF-8, guessing if CSS or HTML.
+
+    CSS and HTML are streamed as they are read, if options allow it.
+    With check on options nothing is written, with diff only the diff.
+    """
+    log.info("Processing StdIn to StdOut.")
+    stdin = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig")
+    stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    try:
+        text = stdin.read(STREAM_SIZE)
+        kind = guess_kind(text)
+        if can_stream(options, kind) and not options.check:
+            stream_text(itertools.chain((text, ), iter(partial(
+                stdin.read, STREAM_SIZE), "")), stdout, kind, options)
+            return Result(True, CACHE_MISS)
+        text += stdin.read()
+        if kind == "css" and options.golden:
+            index = golden_compare(text, justify=options.justify,
+                                   group=options.group)
+            if index != -1:
+                log.error("Golden comparison failed on StdIn at character "
+                          "%s.", index)
+                return Result(False, CACHE_MISS)
+        pretty_text = _prettify_text(text, kind, options)
+        if kind == "css" and options.timestamp:
+            pretty_text = timestamp_comment() + pretty_text
+        changed = pretty_text != text
+        if options.diff and changed:
+            stdout.write(unified_diff(text, pretty_text, "-"))
+        elif not options.check and not options.diff:
+            stdout.write(pretty_text)
+    finally:
+        stdout.flush()
+        stdout.detach()  # Dont close the StdOut and StdIn of the process.
+        stdin.detach()
+    return Result(True, CACHE_MISS, changed=changed)
+
+
+##############################################################################
+# Library API
+
+
+def prettify_css(text, *, group=False, justify=False):
+    """Prettify a CSS / SCSS string, safe to call from several threads."""
+    return css_prettify(text, justify=justify, group=group)
+
+
+def minify_css(text, *, group=False):
+    """Minify a CSS / SCSS string, safe to call from several threads."""
+    return css_minify(text, group=group)
+
+
+def prettify_html(text, *, indent=4, engine="stream", parser="html.parser"):
+    """Prettify a HTML string, safe to call from several threads."""
+    return html_prettify(text, indent=indent, engine=engine, parser=parser)
+
+
+def _process_indexed(indexed_path, options=Options()):
+    """Process an (index, path) tuple, return (index, Result), never raise."""
+    index, file_path = indexed_path
+    try:
+        result = process_multiple_files(file_path, options)
+    except Exception as error:
+        log.error("Error processing %s: %s.", file_path, error)
+        result = Result(False, CACHE_MISS, error="{}: {}".format(
+            type(error).__name__, error))
+    return index, result._replace(worker=worker_status(options))
+
+
+def worker_counters(results):
+    """Return a dict of PID: (memo hits, memo misses, peak RSS) of workers.
+
+    Counters of a process only grow, so its highest ones are the last,
+    threads of a process share them, and this process counts too.
+    """
+    counters = {}
+    for pid, hits, misses, peak, _ in itertools.chain(
+            (result.worker for result in results if result.worker),
+            (worker_status(), )):
+        counters[pid] = tuple(map(max, counters.get(pid, (0, 0, 0)),
+                                  (hits, misses, peak)))
+    return counters
+
+
+def make_pool(workers=None, options=Options(), threads=False):
+    """Return a process Pool, or of threads, recycling workers if asked.
+
+    A process is replaced after tasks_per_child files, so the memory it
+    can not give back is bounded, TASKS_PER_CHILD with a max_worker_mem.
+    Threads share the memory of this process, they are never recycled.
+    """
+    from multiprocessing import cpu_count
+    if threads:
+        from multiprocessing.pool import ThreadPool
+        return ThreadPool(workers or cpu_count())
+    from multiprocessing import Pool
+    return Pool(workers or cpu_count(), maxtasksperchild=(
+        options.tasks_per_child or
+        (TASKS_PER_CHILD if options.max_worker_mem else None)))
+
+
+def file_size(file_path):
+    """Return the size of a file, 0 if it can not be read."""
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+def prettify_files(paths, options=Options(), workers=None, pool=None,
+                   threads=False):
+    """Prettify CSS / SCSS / HTML files, on a process Pool if more than 1.
+
+    Files are dispatched one by one, largest first, to whichever worker is
+    free, so a big file does not keep one worker busy after the rest ended.
+    Paths may be a lazy iterable, then files start while its still walked.
+    Pass a Pool to reuse warm workers between calls, otherwise a new one
+    with workers processes, or threads, is created and closed. Return a
+    list of Result in the same order as paths, errors of a file go on its
+    Result instead of stopping the others.
+    """
+    process = partial(_process_indexed, options=options)
+    by_size = _largest_first(enumerate(paths), window=len(paths) if hasattr(
+        paths, "__len__") else SIZE_WINDOW)
+    if pool is not None:
+        return _in_order(pool.imap_unordered(process, by_size))
+    if workers == 1 or (hasattr(paths, "__len__") and len(paths) < 2):
+        return _in_order(map(process, by_size))
+    set_process_name()
+    pool = make_pool(workers, options, threads)  # Multiprocessing Async
+    try:
+        return _in_order(pool.imap_unordered(process, by_size))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _largest_first(indexed_paths, window):
+    """Yield (index, path) tuples, the largest file first within window.
+
+    A list of paths is fully sorted, a lazy walk starts to yield as soon as
+    window paths are found, so processing overlaps with the discovery.
+    """
+    heap = []
+    for index, file_path in indexed_paths:
+        heapq.heappush(heap, (-file_size(file_path), index, file_path))
+        if len(heap) > window:
+            yield heapq.heappop(heap)[1:]
+    while heap:
+        yield heapq.heappop(heap)[1:]
+
+
+def _in_order(indexed_results):
+    """Return a list of the results of (index, result) tuples, by index."""
+    results = dict(indexed_results)
+    return [results[index] for index in range(len(results))]
+
+
+def prettify_files_async(paths, options=Options(), workers=None,
+                         in_flight=IN_FLIGHT):
+    """Prettify files on an asyncio pipeline, overlapping I/O and CPU work.
+
+    Reads and writes run concurrently on threads, prettify runs on a
+    process pool thru run_in_executor(), and at most in_flight files are on
+    the pipeline at once, so texts do not pile up in memory if the walk is
+    faster than the workers or the writes. Small files go to the workers
+    as text, big ones as paths, the worker does its I/O, since pickling
+    the text costs more. Return a list of Result like prettify_files().
+    Recycling workers needs Python 3.11, they start fresh by spawn then,
+    without the rewrite rules registered at runtime.
+    """
+    import asyncio
+    return asyncio.run(_prettify_files_async(paths, options, workers,
+                                             in_flight))
+
+
+async def _prettify_files_async(paths, options, workers, in_flight):
+    """Feed files to the pipeline largest first, in_flight at most."""
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from multiprocessing import cpu_count
+    loop, slots, tasks = asyncio.get_running_loop(), asyncio.Semaphore(
+        in_flight), []
+    # Files are prettified in parallel already, not chunks of each one.
+    options = options._replace(split_threshold=None)
+    tasks_per_child = options.tasks_per_child or (
+        TASKS_PER_CHILD if options.max_worker_mem else None)
+    recycling = {}
+    if tasks_per_child and sys.version_info >= (3, 11):
+        recycling = {"max_tasks_per_child": tasks_per_child}
+    elif tasks_per_child:
+        log.warning("Recycling asyncio workers needs Python 3.11, ignored.")
+    set_process_name()
+    with ProcessPoolExecutor(workers or cpu_count(), **recycling) as pool, \
+            ThreadPoolExecutor(min(in_flight, 32)) as io_pool:
+        for indexed_path in _largest_first(enumerate(paths), window=len(
+                paths) if hasattr(paths, "__len__") else SIZE_WINDOW):
+            await slots.acquire()
+            tasks.append(loop.create_task(_process_async(
+                loop, (pool, io_pool), slots, indexed_path, options)))
+        return _in_order(await asyncio.gather(*tasks))
+
+
+async def _process_async(loop, pools, slots, indexed_path, options):
+    """Read, prettify and write a file on the pools, never raise.
+
+    Return (index, Result) like _process_indexed(), and release its slot.
+    """
+    pool, io_pool = pools
+    index, file_path = indexed_path
+    kind = "css" if file_path.endswith((".css", ".scss")) else "html"
+    try:
+        if (can_stream(options, kind) or options.profile_dir or
+                file_size(file_path) >= PATH_SIZE):
+            return await loop.run_in_executor(
+                pool, _process_indexed, indexed_path, options)
+        log.info("Processing %s file: %s", kind.upper(), file_path)
+        metrics = new_metrics(file_path, kind, options)
+        with timed(metrics and metrics["stages"], "read"):
+            text = await loop.run_in_executor(io_pool, read_text, file_path)
+        prettified, worker = await loop.run_in_executor(
+            pool, _prettify_on_worker, file_path, text, kind, options,
+            metrics)
+        result = await loop.run_in_executor(
+            io_pool, finish_file, prettified, options)
+        return index, result._replace(worker=worker)
+    except Exception as error:
+        log.error("Error processing %s: %s.", file_path, error)
+        return index, Result(False, CACHE_MISS, error="{}: {}".format(
+            type(error).__name__, error))
+    finally:
+        slots.release()
+
+
+def _prettify_on_worker(file_path, text, kind, options, metrics):
+    """Prettify a file text on a worker, return (Prettified, worker status)."""
+    if metrics is not None:  # Dont count the time waiting for a worker.
+        metrics.update(pid=os.getpid(), started=monotonic())
+    prettified = prettify_file_text(file_path, text, kind, options, metrics)
+    return prettified, worker_status(options)
+
+
+##############################################################################
+# Archives
+
+
+ARCHIVES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz",
+            ".txz", ".zip")
+TAR_COMPRESSIONS = {"gz": "gz", "tgz": "gz", "bz2": "bz2", "tbz2": "bz2",
+                    "xz": "xz", "txz": "xz"}
+SPOOL_SIZE = 1024 * 1024  # Bytes of a waiting member kept in memory.
+
+
+def is_archive(file_path):
+    """Return True if file_path is a tar or zip archive, by its name."""
+    return file_path.lower().endswith(ARCHIVES)
+
+
+@contextmanager
+def archive_streams(archive_path, output_file):
+    """Open an archive to read it once and an output archive of its type.
+
+    Yield (members, add): members yields (name, info, file object or None,
+    True if a regular file) in the order of the archive, a tar is read as
+    a stream so each file object is valid until the next member, zip links
+    are regular files but for its mode. add(info, file object or None,
+    size, name) appends a member with the metadata of info, with a new
+    size and name if not None.
+    """
+    import shutil
+    import stat
+    import tarfile
+    import zipfile
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as source, zipfile.ZipFile(
+                output_file, "w") as output:
+            def add(info, data, size=None, name=None):
+                """Append a zip member, compressed like the original."""
+                info = copy(info)
+                info.filename = name or info.filename
+                if data is None:
+                    output.writestr(info, b"")
+                    return
+                info.file_size = info.file_size if size is None else size
+                with output.open(info, "w") as member:
+                    shutil.copyfileobj(data, member, STREAM_SIZE)
+
+            output.comment = source.comment
+            yield ((info.filename, info, None if info.is_dir() else
+                    source.open(info), not info.is_dir() and
+                    not stat.S_ISLNK(info.external_attr >> 16))
+                   for info in source.infolist()), add
+        return
+    compression = TAR_COMPRESSIONS.get(
+        archive_path.lower().rpartition(".")[2], "")
+    with tarfile.open(archive_path, "r|*") as source, tarfile.open(
+            archive_path, "w|" + compression, fileobj=output_file) as output:
+        def add(info, data, size=None, name=None):
+            """Append a tar member, with all its headers."""
+            if size is not None or name:
+                info = copy(info)
+                info.size = info.size if size is None else size
+                info.name = name or info.name
+            output.addfile(info, data)
+
+        yield ((member.name, member, source.extractfile(member) if
+                member.isfile() else None, member.isfile())
+               for member in source), add
+
+
+def prettify_archive(archive_path, output_path=None, target=(".css",),
+                     omit=(), options=Options(), workers=None,
+                     in_flight=IN_FLIGHT):
+    """Prettify the CSS / SCSS / HTML members of a tar or zip archive.
+
+    Members are read once in order, target ones are prettified on a Pool
+    while the rest pass thru unchanged, and an archive of the same type is
+    written with the same order and metadata, over archive_path thru a
+    temporary file by default. Outputs of a prefix or minify are added
+    after its member. At most in_flight members wait for the Pool, members
+    behind them wait spooled, on disk if big. With check or diff on
+    options no archive is written. Return a list of (name, Result) of the
+    target members.
+    """
+    import shutil
+    import tempfile
+    from collections import deque
+    output_path = output_path or archive_path
+    write = not (options.check or options.diff)
+    pending, results, names = deque(), [], set()
+    set_process_name()
+    pool = make_pool(workers, options)
+    if write:
+        output_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(
+            os.path.abspath(output_path)), suffix=".tmp", delete=False)
+    else:
+        output_file = open(os.devnull, "wb")
+    try:
+        with output_file, archive_streams(archive_path, output_file) as (
+                members, add):
+            for name, info, data, regular in members:
+                names.add(name)
+                if len(pending) >= in_flight:
+                    results.extend(_add_pending(pending.popleft(), add,
+                                                options))
+                folder, _, base_name = name.rpartition("/")
+                if regular and is_target_file(
+                        base_name, target, omit, options.prefix,
+                        lambda original: (folder + "/" + original if folder
+                                          else original) in names):
+                    raw = data.read()
+                    kind = "css" if name.endswith((".css", ".scss")) else (
+                        "html")
+                    pending.append((name, info, raw, pool.apply_async(
+                        _prettify_member, (name, raw, kind, options))))
+                elif pending and data is not None:
+                    spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+                    shutil.copyfileobj(data, spool, STREAM_SIZE)
+                    spool.seek(0)
+                    pending.append((name, info, spool, None))
+                elif pending:
+                    pending.append((name, info, None, None))
+                else:
+                    add(info, data)
+            while pending:
+                results.extend(_add_pending(pending.popleft(), add,
+                                            options))
+        if write:  # Permissions of the archive replaced, or the input.
+            os.chmod(output_file.name, os.stat(
+                output_path if os.path.exists(output_path) else
+                archive_path).st_mode & 0o7777)
+            os.replace(output_file.name, output_path)
+    finally:
+        pool.close()
+        pool.join()
+        if write and os.path.exists(output_file.name):
+            os.remove(output_file.name)
+    return results
+
+
+def _prettify_member(name, raw, kind, options):
+    """Prettify the Bytes of an archive member on a worker.
+
+    Return (Prettified, worker status) like _prettify_on_worker().
+    """
+    return _prettify_on_worker(name, raw.decode("utf-8-sig"), kind,
+                               options, None)
+
+
+def _add_pending(entry, add, options=Options()):
+    """Add a member that waited to the archive, return its (name, Result).
+
+    A member that failed to prettify is added unchanged.
+    """
+    name, info, data, prettifying = entry
+    if prettifying is None:  # Passed thru, spooled while waiting.
+        add(info, data)
+        if data is not None:
+            data.close()
+        return []
+    try:
+        prettified, worker = prettifying.get()
+    except Exception as error:
+        log.error("Error processing %s: %s.", name, error)
+        add(info, io.BytesIO(data))
+        return [(name, Result(False, CACHE_MISS, error="{}: {}".format(
+            type(error).__name__, error)))]
+    if not prettified.ok:
+        add(info, io.BytesIO(data))
+        return [(name, Result(False, prettified.cache_status, worker=worker))]
+    if name not in dict(prettified.outputs):  # A prefix keeps the original.
+        add(info, io.BytesIO(data))
+    changed, diffs = False, []
+    for output_name, text in prettified.outputs:
+        pretty, old = text.encode("utf-8"), (
+            data if output_name == name else None)
+        if pretty != old:
+            changed = True
+            if options.diff:
+                diffs.append(unified_diff(old.decode("utf-8-sig") if old
+                                          else "", text, output_name))
+        add(info, io.BytesIO(pretty), len(pretty), output_name)
+    return [(name, Result(True, prettified.cache_status, changed=changed,
+                          diff="".join(diffs) or None, worker=worker))]
+
+
+##############################################################################
+# Shards
+
+
+def parse_shard(text):
+    """Return (index, count) of a shard like 1/4, for the argument parser."""
+    from argparse import ArgumentTypeError
+    try:
+        index, count = map(int, text.split("/"))
+    except ValueError:
+        raise ArgumentTypeError("shard must be i/N, like 1/4.")
+    if not 1 <= index <= count:
+        raise ArgumentTypeError("shard i/N must have 1 <= i <= N.")
+    return index, count
+
+
+def tree_fingerprint(sizes):
+    """Return a SHA256 of relative path: size of all the files of a tree."""
+    import hashlib
+    hashed = hashlib.sha256()
+    for relative_path in sorted(sizes):
+        hashed.update("{}\0{}\n".format(relative_path, sizes[
+            relative_path]).encode("utf-8", "surrogateescape"))
+    return hashed.hexdigest()
+
+
+def shard_files(paths, root, index, count):
+    """Return ({path: size} of shard index of count, tree) of all paths.
+
+    Every machine with its own copy of the same tree gets the same
+    partition, a shared copy would not, files prettified in place change
+    its size. Largest files go first, each to the shard with fewest Bytes
+    so far, the lowest shard on ties, files of equal size by relative
+    path. Empty files weigh 1 Byte so they spread too. tree is a dict of
+    the total files, Bytes and fingerprint, so merge_manifests() can
+    verify the coverage.
+    """
+    sizes = dict((os.path.relpath(file_path, root), file_size(file_path))
+                 for file_path in paths)
+    loads, shard = [(0, number) for number in range(count)], set()
+    for relative_path in sorted(sizes, key=lambda relative_path: (
+            -sizes[relative_path], relative_path)):
+        load, number = heapq.heappop(loads)
+        if number == index - 1:
+            shard.add(relative_path)
+        heapq.heappush(loads, (load + max(sizes[relative_path], 1), number))
+    tree = {"files": len(sizes), "bytes": sum(sizes.values()),
+            "sha256": tree_fingerprint(sizes)}
+    return dict((os.path.join(root, relative_path), size) for relative_path,
+                size in sizes.items() if relative_path in shard), tree
+
+
+def file_sha256(file_path):
+    """Return the SHA256 of a file, None if it can not be read."""
+    import hashlib
+    hashed = hashlib.sha256()
+    try:
+        with open(file_path, "rb") as hashed_file:
+            for block in iter(partial(hashed_file.read, STREAM_SIZE), b""):
+                hashed.update(block)
+    except (IOError, OSError):
+        return None
+    return hashed.hexdigest()
+
+
+def output_file_paths(file_path, options=Options()):
+    """Return the paths of the files written for file_path with options."""
+    output_path = prefixer_extensioner(file_path, options.prefix)
+    if options.minify and file_path.endswith(".css"):
+        return [output_path, minified_file_path(output_path)]
+    return [output_path]
+
+
+def shard_manifest(root, sizes, results, shard, tree, options=Options()):
+    """Return the manifest of a shard run, a dict to save as JSON.
+
+    It has the inputs with its Bytes, the SHA256 of its outputs as they
+    are on disk after the run, its seconds and errors, and the tree.
+    """
+    files = []
+    for (file_path, size), result in zip(sizes.items(), results):
+        files.append({
+            "path": os.path.relpath(file_path, root), "bytes": size,
+            "ok": result.ok, "changed": result.changed, "error": result.error,
+            "seconds": result.metrics and result.metrics["seconds"],
+            "outputs": dict((os.path.relpath(output_path, root), file_sha256(
+                output_path)) for output_path in output_file_paths(
+                    file_path, options) if os.path.isfile(output_path))})
+    return {"version": __version__, "shard": shard[0], "shards": shard[1],
+            "tree": tree, "seconds": (datetime.now() - start_time
+                                      ).total_seconds(), "files": files}
+
+
+def write_manifest(manifest_path, manifest):
+    """Save a manifest as JSON, atomically."""
+    import json
+    write_atomic(manifest_path, json.dumps(
+        manifest, indent=2, sort_keys=True).encode("utf-8"))
+    log.info("Manifest saved to %s.", manifest_path)
+
+
+def merge_manifests(manifest_paths):
+    """Combine the manifests of the shards of a run, verify it covered all.
+
+    Return (manifest, problems), problems is a list of the shards missing,
+    repeated or of another tree, files on several shards, files missing
+    versus the tree fingerprint, and files that failed.
+    """
+    import json
+    manifests, problems = [], []
+    for manifest_path in manifest_paths:
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            manifests.append(json.load(manifest_file))
+    first = manifests[0]
+    shards = sorted(manifest["shard"] for manifest in manifests)
+    for manifest_path, manifest in zip(manifest_paths, manifests):
+        if (manifest["shards"], manifest["tree"]) != (
+                first["shards"], first["tree"]):
+            problems.append("{} is of another run, {} shards of tree {}."
+                            .format(manifest_path, manifest["shards"],
+                                    manifest["tree"]["sha256"]))
+    for number in range(1, first["shards"] + 1):
+        if shards.count(number) != 1:
+            problems.append("Shard {}/{} found {} times.".format(
+                number, first["shards"], shards.count(number)))
+    files = {}
+    for manifest in manifests:
+        for file_entry in manifest["files"]:
+            if file_entry["path"] in files:
+                problems.append("{} is on several shards.".format(
+                    file_entry["path"]))
+            files[file_entry["path"]] = file_entry
+            if not file_entry["ok"]:
+                problems.append("{} failed, {}.".format(
+                    file_entry["path"], file_entry["error"]))
+    sizes = dict((path, entry["bytes"]) for path, entry in files.items())
+    if tree_fingerprint(sizes) != first["tree"]["sha256"]:
+        problems.append("Files cover {} of {} of the tree, {} of {} Bytes."
+                        .format(len(sizes), first["tree"]["files"],
+                                sum(sizes.values()),
+                                first["tree"]["bytes"]))
+    return {"version": __version__, "shards": first["shards"],
+            "tree": first["tree"], "seconds": max(
+                manifest["seconds"] for manifest in manifests),
+            "files": [files[path] for path in sorted(files)]}, problems
+
+
+def merge_command(manifest_paths, merged_path=None):
+    """Merge shard manifests, log the problems, return the exit code."""
+    manifest, problems = merge_manifests(manifest_paths)
+    for problem in problems:
+        log.error(problem)
+    if merged_path:
+        write_manifest(merged_path, manifest)
+    log.info("Merged %s shards, %s of %s files, %s problems.", len(
+        manifest_paths), len(manifest["files"]), manifest["tree"]["files"],
+        len(problems))
+    return 1 if problems else 0
+
+
+##############################################################################
+# Daemon
+
+
+FRAME = struct.Struct(">I")  # Messages are JSON prefixed by its length.
+EVICT_INTERVAL = 60  # Seconds between evictions of the cache of the daemon.
+EVICTED_AT = {}  # Cache folder: monotonic() of its last eviction.
+DAEMON_TARGET = (".css", ".scss", ".html", ".htm")  # Files it processes.
+
+
+def send_message(connection, message):
+    """Send a message as length prefixed UTF-8 JSON thru a socket."""
+    import json
+    payload = json.dumps(message).encode("utf-8")
+    connection.sendall(FRAME.pack(len(payload)) + payload)
+
+
+def receive_message(connection):
+    """Receive a length prefixed UTF-8 JSON message, None if closed."""
+    import json
+    header = _receive_exactly(connection, FRAME.size)
+    if header is None:
+        return None
+    payload = _receive_exactly(connection, FRAME.unpack(header)[0])
+    if payload is None:
+        raise IOError("Connection closed in the middle of a message.")
+    return json.loads(payload.decode("utf-8"))
+
+
+def _receive_exactly(connection, size):
+    """Receive exactly size bytes from a socket, None if closed."""
+    chunks = []
+    while size:
+        chunk = connection.recv(min(size, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def check_daemon_path(file_path):
+    """Raise ValueError unless file_path is a CSS, SCSS or HTML file.
+
+    Anything else would be rewritten in place as HTML, so like the CLI,
+    the daemon only takes the files it would find walking a folder.
+    """
+    if not file_path.endswith(DAEMON_TARGET) or os.path.isdir(file_path):
+        raise ValueError("Not a CSS / SCSS or HTML file: {}".format(
+            file_path))
+
+
+def _prettify_text(text, kind, options):
+    """Prettify CSS or HTML text with options, on a Pool worker."""
+    if kind == "html":
+        return prettify_html(text, indent=options.indent,
+                             engine=options.html_engine,
+                             parser=options.html_parser)
+    if options.minify:
+        return minify_css(text, group=options.group)
+    return prettify_css(text, group=options.group, justify=options.justify)
+
+
+def handle_request(message, pool):
+    """Handle a request message of the daemon, return the response message.
+
+    A request has 'options', a dict of Options fields, and either 'path' of
+    a file to process or 'text' to prettify with its 'kind', css or html.
+    """
+    try:
+        options = Options(**dict((key, value) for key, value in message.get(
+            "options", {}).items() if key in Options._fields))
+        if "path" in message:
+            check_daemon_path(message["path"])
+            result = pool.apply(
+                process_multiple_files, (message["path"], options))
+            evict_from_time_to_time(options)
+            return {"ok": result.ok, "cache": result.cache_status,
+                    "metrics": result.metrics, "changed": result.changed,
+                    "diff": result.diff}
+        return {"ok": True, "text": pool.apply(_prettify_text, (
+            message["text"], message.get("kind", "css"), options))}
+    except Exception as error:
+        log.error("Error on request: %s.", error)
+        return {"ok": False, "error": "{}".format(error)}
+
+
+def evict_from_time_to_time(options):
+    """Evict the cache of options, at most once every EVICT_INTERVAL.
+
+    The daemon never ends, so its cache is bounded while it runs.
+    """
+    if not cache_writable(options):
+        return
+    now = monotonic()
+    if now - EVICTED_AT.get(options.cache_dir, -EVICT_INTERVAL) < (
+            EVICT_INTERVAL):
+        return
+    EVICTED_AT[options.cache_dir] = now
+    cache_evict(options.cache_dir, options.cache_size * 1024 * 1024)
+
+
+def serve_connection(connection, pool, slots):
+    """Answer all the requests of a client connection, until it closes."""
+    try:
+        with connection:
+            while True:
+                message = receive_message(connection)
+                if message is None:
+                    break
+                with slots:  # Limit requests processed at the same time.
+                    response = handle_request(message, pool)
+                send_message(connection, response)
+    except (IOError, OSError, ValueError) as error:
+        log.warning("Client connection error: {}.".format(error))
+
+
+def serve(socket_path, workers=None, concurrency=None):
+    """Serve requests on a local Unix socket forever, with a warm Pool.
+
+    The Pool and the compiled property tables stay resident, so clients
+    dont pay the start up of the interpreter and the imports on each file.
+    """
+    import socket
+    from multiprocessing import cpu_count, Pool
+    try:
+        remove_stale_socket(socket_path)
+    except (IOError, OSError) as error:
+        log.critical("Can not serve on {}: {}".format(socket_path, error))
+        return 1
+    set_process_name()
+    workers = workers or cpu_count()
+    pool = Pool(workers)
+    slots = threading.BoundedSemaphore(concurrency or workers * 2)
+    server, bound = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), False
+    try:
+        umask = os.umask(0o177)  # Only this user, from the start.
+        try:
+            server.bind(socket_path)
+            bound = True
+        finally:
+            os.umask(umask)
+        server.listen(128)
+        log.info("Serving on {} with {} workers.".format(socket_path, workers))
+        while True:
+            connection, _ = server.accept()
+            threading.Thread(target=serve_connection, daemon=True,
+                             args=(connection, pool, slots)).start()
+    except KeyboardInterrupt:
+        log.info("Stopped serving on {}.".format(socket_path))
+    finally:
+        server.close()
+        pool.terminate()
+        if bound and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def remove_stale_socket(socket_path):
+    """Remove a socket left by a daemon that is gone, if any.
+
+    Raise IOError if something else is on socket_path, or a daemon that
+    still answers, they are not ours to take over.
+    """
+    import socket
+    import stat
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise IOError("It exists and it is not a socket.")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            log.info("Removing stale socket {}.".format(socket_path))
+            os.remove(socket_path)
+            return
+    raise IOError("A daemon is already serving on it.")
+
+
+def client_request(socket_path, message):
+    """Send a single request to a daemon, return its response message."""
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        send_message(connection, message)
+        response = receive_message(connection)
+    if response is None:
+        raise IOError("Daemon closed the connection without a response.")
+    return response
+
+
+def run_client(socket_path, file_path, options):
+    """Forward a file, or StdIn if file path is '-', to a daemon.
+
+    Files are processed by the daemon as usual, StdIn goes to StdOut.
+    Return True if the daemon processed it without errors, and with check
+    on options, without changes.
+    """
+    message = {"options": options._asdict()}
+    if file_path == "-":
+        message["text"] = sys.stdin.read()
+        message["kind"] = guess_kind(message["text"])
+    else:
+        try:
+            check_daemon_path(file_path)
+        except ValueError as error:
+            log.error("Not sent to the daemon: %s.", error)
+            return False
+        message["path"] = os.path.abspath(file_path)
+    response = client_request(socket_path, message)
+    if not response["ok"]:
+        log.error("Daemon failed to process %s: %s.", file_path,
+                  response.get("error"))
+    elif file_path == "-":
+        sys.stdout.write(response["text"])
+    elif response.get("diff"):
+        sys.stdout.write(response["diff"])
+    return response["ok"] and not (options.check and response.get("changed"))
+
+
+##############################################################################
+# Watch
+
+
+IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x8, 0x80, 0x100
+IN_Q_OVERFLOW, IN_ISDIR = 0x4000, 0x40000000
+INOTIFY_EVENT = struct.Struct("iIII")
+WATCH_DEBOUNCE, WATCH_MAX_DELAY, WATCH_POLL = 0.2, 0.8, 0.5
+
+
+def inotify_changes(where, timeout, exclude=(), ignore_files=IGNORE_FILES):
+    """Watch the whole tree with Linux inotify thru ctypes.
+
+    Return a generator of paths of files written or moved in, that yields
+    None after timeout seconds without events. New folders get watched,
+    folders are pruned and files ignored like iter_target_files().
+    """
+    import select
+    from ctypes import cdll
+    libc = cdll.LoadLibrary("libc.so.6")
+    inotify_fd = libc.inotify_init()
+    if inotify_fd == -1:
+        raise OSError("Can not initialize inotify.")
+    folders = {}  # Watch: (folder, relative folder, rules).
+
+    def add_watch(folder, relative_folder="", rules=None):
+        """Add a folder to the inotify watches, return its files."""
+        for root, relative_root, root_rules, entries in walk_folders(
+                folder, exclude, ignore_files, relative_folder, rules):
+            watch = libc.inotify_add_watch(
+                inotify_fd, os.fsencode(root),
+                IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if watch != -1:
+                folders[watch] = (root, relative_root, root_rules)
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False) and not (
+                        is_ignored(entry.name, relative_to(
+                            relative_root, entry.name), False, root_rules)):
+                    yield entry.path
+
+    for _ in add_watch(where):
+        pass
+
+    def changes():
+        """Read and decode inotify events, forever."""
+        try:
+            while True:
+                if not select.select([inotify_fd], [], [], timeout)[0]:
+                    yield None
+                    continue
+                events, offset = os.read(inotify_fd, 64 * 1024), 0
+                while offset < len(events):
+                    watch, mask, _, length = INOTIFY_EVENT.unpack_from(
+                        events, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = events[offset:offset + length].rstrip(b"\0")
+                    offset += length
+                    if mask & IN_Q_OVERFLOW:  # Events lost, check all.
+                        for file_path in add_watch(where):
+                            yield file_path
+                    elif watch in folders and name:
+                        folder, relative_folder, rules = folders[watch]
+                        name = os.fsdecode(name)
+                        path = os.path.join(folder, name)
+                        relative_path = relative_to(relative_folder, name)
+                        if not mask & IN_ISDIR:
+                            if not is_ignored(name, relative_path, False,
+                                              rules):
+                                yield path
+                        elif mask & (IN_CREATE | IN_MOVED_TO) and not (
+                                is_pruned(name, relative_path, rules)):
+                            for file_path in add_watch(path, relative_path,
+                                                       rules):
+                                yield file_path
+        finally:
+            os.close(inotify_fd)
+    return changes()
+
+
+def polling_changes(where, timeout, exclude=(), ignore_files=IGNORE_FILES):
+    """Watch the whole tree polling it with scandir every timeout seconds.
+
+    Return a generator of paths of new or modified files, that yields None
+    after each poll. Folders are pruned and files ignored like
+    iter_target_files().
+    """
+    def snapshot(folder):
+        """Return a dict of path to (mtime, size) of all files on folder."""
+        signatures = {}
+        for _, relative_folder, rules, entries in walk_folders(
+                folder, exclude, ignore_files):
+            for entry in entries:
+                try:
+                    if entry.is_file() and not is_ignored(
+                            entry.name, relative_to(relative_folder,
+                                                    entry.name),
+                            False, rules):
+                        stat = entry.stat()
+                        signatures[entry.path] = (stat.st_mtime_ns,
+                                                  stat.st_size)
+                except OSError:
+                    continue  # Deleted or not readable while scanning.
+        return signatures
+
+    def changes():
+        """Compare snapshots and yield the difference, forever."""
+        previous = snapshot(where)
+        while True:
+            sleep(timeout)
+            actual = snapshot(where)
+            for path, signature in actual.items():
+                if previous.get(path) != signature:
+                    yield path
+            previous = actual
+            yield None
+    return changes()
+
+
+def is_sibling(file_path, name):
+    """Return True if a file called name is on the folder of file_path."""
+    return os.path.exists(os.path.join(os.path.dirname(file_path), name))
+
+
+def file_signature(file_path):
+    """Return the (mtime, size) of a file, None if it does not exist."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def watch_folder(where, target, omit, options=Options(), exclude=(),
+                 ignore_files=IGNORE_FILES):
+    """Watch a whole folder and re-process files on a shared process Pool.
+
+    Bursts of saves are debounced, and files written by the Pool itself
+    are recognized by their signature so they dont trigger a new run.
+    Workers never end watching, so if one is still over max_worker_mem
+    after freeing, the Pool is recycled as soon as its idle.
+    """
+    try:
+        changes = inotify_changes(where, WATCH_DEBOUNCE, exclude,
+                                  ignore_files)
+        log.info("Watching {} using inotify.".format(where))
+    except Exception as reason:
+        log.debug("Inotify not available: {}.".format(reason))
+        changes = polling_changes(where, WATCH_POLL, exclude, ignore_files)
+        log.info("Watching {} polling every {} Secs.".format(
+            where, WATCH_POLL))
+    set_process_name()
+    pool = make_pool(options=options)
+    changed, in_flight, written = set(), set(), {}
+    first_change, over_budget = None, []
+
+    def done(paths, indexed_result=None):
+        """Remember signature of written files, so they are not re-run."""
+        for path in paths:
+            written[path] = file_signature(path)
+        worker = indexed_result and indexed_result[1].worker
+        if worker and options.max_worker_mem and (
+                worker[4] > options.max_worker_mem):
+            over_budget.append(worker[0])
+        in_flight.difference_update(paths)
+
+    def failed(paths, error):
+        """Log errors of a file without stopping watching."""
+        log.error("Error processing %s: %s.", paths[0], error)
+        in_flight.difference_update(paths)
+
+    try:
+        for path in changes:
+            if path is not None:
+                if is_target_file(os.path.basename(path), target, omit,
+                                  options.prefix, partial(is_sibling, path)):
+                    changed.add(path)
+                    first_change = first_change or monotonic()
+                if not changed or monotonic() - first_change < WATCH_MAX_DELAY:
+                    continue
+            if over_budget and not in_flight:
+                log.info("Recycling the Pool, workers %s over budget.",
+                         sorted(set(over_budget)))
+                pool.close()
+                pool.join()
+                pool = make_pool(options=options)
+                del over_budget[:]
+            for path in sorted(changed):
+                if path in in_flight:
+                    continue  # Wait for the Pool, it may be our own write.
+                changed.discard(path)
+                if written.get(path) == file_signature(path):
+                    continue
+                log.debug("Modification detected on %s.", path)
+                paths = tuple(set((path, prefixer_extensioner(
+                    path, options.prefix))))
+                in_flight.update(paths)
+                pool.apply_async(_process_indexed, ((0, path), options),
+                                 callback=partial(done, paths),
+                                 error_callback=partial(failed, paths))
+            first_change = monotonic() if changed else None
+    except KeyboardInterrupt:
+        log.info("Stopped watching {}.".format(where))
+    finally:
+        pool.terminate()
 
 
 def check_for_updates():
     """Method to check for updates from Git repo versus this version."""
+    from urllib import request
     this_version = str(open(__file__).read())
     last_version = str(request.urlopen(__source__).read().decode("utf8"))
     if this_version != last_version:
@@ -440,8 +2746,9 @@ def check_for_updates():
         log.info("No new updates!,You have the lastest version of this app.")
 
 
-def make_arguments_parser():
-    """Build and return a command line agument parser."""
+def make_logger():
+    """Log to a file on the temp folder and to StdErr, with colors on TTY."""
+    from tempfile import gettempdir
     if not sys.platform.startswith("win") and sys.stderr.isatty():
         def add_color_emit_ansi(fn):
             """Add methods we need to the class."""
@@ -478,7 +2785,133 @@ def make_arguments_parser():
         level=-1, format="%(levelname)s:%(asctime)s %(message)s", filemode="w",
         filename=os.path.join(gettempdir(), "css-html-prettify.log"))
     log.getLogger().addHandler(log.StreamHandler(sys.stderr))
+
+
+def peak_memory_megabytes():
+    """Return the peak RSS of this process in MegaBytes, 0 if unknown."""
+    try:
+        import resource  # windows dont have resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is on KiloBytes, except on Mac that is on Bytes.
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def memory_megabytes():
+    """Return the RSS of this process now in MegaBytes, its peak if unknown.
+
+    The peak only grows, the RSS now tells if freeing memory worked.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return peak_memory_megabytes()
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def release_memory(budget):
+    """Free what a worker keeps between files, if over budget MegaBytes.
+
+    Collects the reference cycles the parsed documents leave, then if still
+    over budget empties the sorted blocks memo and gives the free heap back
+    to the OS with malloc_trim() of glibc. Return the RSS after freeing.
+    """
+    import gc
+    gc.collect()
+    rss = memory_megabytes()
+    if rss <= budget:
+        return rss
+    clear_block_memo()
+    gc.collect()
+    try:
+        from ctypes import cdll
+        cdll.LoadLibrary('libc.so.6').malloc_trim(0)
+    except Exception:
+        pass  # Not glibc, the memory goes back when the worker is recycled.
+    freed = memory_megabytes()
+    log.debug("Worker %s over budget of %s MegaBytes, from %.1f to %.1f.",
+              os.getpid(), budget, rss, freed)
+    return freed
+
+
+def worker_status(options=Options()):
+    """Return (PID, memo hits, memo misses, peak RSS, RSS) of this process.
+
+    With a max_worker_mem budget the memory is released first, so call it
+    after each file. RSS are in MegaBytes.
+    """
+    rss = (release_memory(options.max_worker_mem) if options.max_worker_mem
+           else memory_megabytes())
+    return block_memo_counters() + (peak_memory_megabytes(), rss)
+
+
+def _recording(iterable, record):
+    """Yield the items of iterable, appending them to the record list."""
+    for item in iterable:
+        record.append(item)
+        yield item
+
+
+def profile_folder(profile_dir=None):
+    """Return the folder for cProfile dumps, created if needed."""
+    if not profile_dir:
+        from tempfile import gettempdir
+        profile_dir = os.path.join(gettempdir(), "css-html-prettify-profiles")
+    os.makedirs(profile_dir, exist_ok=True)
+    return profile_dir
+
+
+def report_metrics(results, metrics_path=None, keep_profiles=0):
+    """Log the slowest stages and files, save all the metrics as JSON.
+
+    Only the cProfile dumps of the keep_profiles slowest files are kept.
+    """
+    metrics = sorted((result.metrics for result in results if result.metrics),
+                     key=lambda file_metrics: file_metrics["seconds"],
+                     reverse=True)
+    stages, workers = {}, {}
+    for pid, (hits, misses, peak) in worker_counters(results).items():
+        if hits or misses or pid != os.getpid():
+            workers[str(pid)] = {"files": 0, "seconds": 0.0, "bytes_in": 0,
+                                 "bytes_out": 0, "memo_hits": hits,
+                                 "memo_misses": misses, "peak_mb": peak}
+    for file_metrics in metrics:
+        for stage, seconds in file_metrics["stages"].items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        worker = workers.setdefault(str(file_metrics["pid"]), {
+            "files": 0, "seconds": 0.0, "bytes_in": 0, "bytes_out": 0})
+        worker["files"] += 1
+        for key in ("seconds", "bytes_in", "bytes_out"):
+            worker[key] += file_metrics[key]
+    log.info("Slowest Stages: %s.", ", ".join("{} {:.3f}s".format(
+        stage, seconds) for stage, seconds in sorted(
+            stages.items(), key=lambda stage: stage[1], reverse=True)))
+    for file_metrics in metrics[:5]:
+        log.info("Slow File: %s %.3fs, %s to %s Bytes, PID %s, Cache %s.",
+                 file_metrics["path"], file_metrics["seconds"],
+                 file_metrics["bytes_in"], file_metrics["bytes_out"],
+                 file_metrics["pid"], file_metrics["cache"])
+    for file_metrics in metrics[keep_profiles:]:
+        if "profile" in file_metrics:
+            os.remove(file_metrics.pop("profile"))
+    for file_metrics in metrics[:keep_profiles]:
+        if "profile" in file_metrics:
+            log.info("cProfile of %s: %s", file_metrics["path"],
+                     file_metrics["profile"])
+    if metrics_path:
+        import json
+        with open(metrics_path, "w", encoding="utf-8") as metrics_file:
+            json.dump({"files": metrics, "stages": stages,
+                       "workers": workers}, metrics_file, indent=2)
+        log.info("Metrics saved to %s.", metrics_path)
+
+
+def set_process_name():
+    """Set a smooth cpu priority and the process name, for long runs."""
     try:
+        from ctypes import byref, cdll, create_string_buffer
         os.nice(19)  # smooth cpu priority
         libc = cdll.LoadLibrary('libc.so.6')  # set process name
         buff = create_string_buffer(len("css-html-prettify") + 1)
@@ -486,16 +2919,21 @@ def make_arguments_parser():
         libc.prctl(15, byref(buff), 0, 0, 0)
     except Exception:
         pass  # this may fail on windows and its normal, so be silent.
-    # Parse command line arguments.
+
+
+def make_arguments_parser():
+    """Build and return a command line agument parser."""
     parser = ArgumentParser(description=__doc__, epilog="""CSS-HTML-Prettify:
     Takes file or folder full path string and process all CSS/SCSS/HTML found.
     If argument is not file/folder will fail. Check Updates works on Python3.
-    StdIn to StdOut is deprecated since may fail with unicode characters.
+    Use - as fullpath to read StdIn and write StdOut, both as UTF-8.
     CSS Properties are AlphaSorted,to help spot cloned ones,Selectors not.
-    Watch works for whole folders, with minimum of ~60 Secs between runs.""")
+    Watch works for whole folders, thru inotify on Linux or polling.
+    Archives .tar, .tar.gz, .zip are rewritten with its members prettified.
+    Use --shard i/N on each machine, then --merge of its manifests.""")
     parser.add_argument('--version', action='version', version=__version__)
-    parser.add_argument('fullpath', metavar='fullpath', type=str,
-                        help='Full path to local file or folder.')
+    parser.add_argument('fullpath', metavar='fullpath', type=str, nargs='?',
+                        help='Full path to local file, folder or archive.')
     parser.add_argument('--prefix', type=str,
                         help="Prefix string to prepend on output filenames.")
     parser.add_argument('--timestamp', action='store_true',
@@ -514,8 +2952,90 @@ def make_arguments_parser():
                         help="Group Alphabetically CSS Poperties by name.")
     parser.add_argument('--justify', action='store_true',
                         help="Right Justify CSS Properties (Experimental).")
-    global args
-    args = parser.parse_args()
+    parser.add_argument('--golden', action='store_true',
+                        help="Compare CSS output versus the Legacy pipeline.")
+    parser.add_argument('--cache', action='store_true',
+                        help="Use the content hash cache of outputs, the "
+                        "default only for folders.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Disable the content hash cache of outputs, "
+                        "for folders too.")
+    parser.add_argument('--cache-dir', type=str, default=CACHE_DIR,
+                        help="Folder to store the cache of outputs.")
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help="Maximum size of the cache in MegaBytes.")
+    parser.add_argument('--split-threshold', type=int, default=1024,
+                        help="Format CSS bigger than this KiloBytes on "
+                        "parallel chunks, 0 to disable. Never on --threads "
+                        "workers or a single CPU.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Stream CSS rule by rule and HTML tag by tag, "
+                        "with bounded memory, for huge files and pipes.")
+    parser.add_argument('--check', action='store_true',
+                        help="Dont write, list files that would change, "
+                        "exit with 1 if any.")
+    parser.add_argument('--diff', action='store_true',
+                        help="Dont write, print an unified diff of changes.")
+    parser.add_argument('--minify', action='store_true',
+                        help="Also write a minified copy of CSS, like "
+                        "foo.min.css, StdIn and the daemon only minify.")
+    parser.add_argument('--html-engine', choices=("stream", "bs4"),
+                        default="stream", help="HTML engine, stream thru "
+                        "html.parser or a whole BeautifulSoup tree.")
+    parser.add_argument('--html-parser', type=str, default="html.parser",
+                        help="Parser of the bs4 HTML engine, like lxml.")
+    parser.add_argument('--exclude', action='append', default=[],
+                        metavar='GLOB', help="Skip files and folders "
+                        "matching the glob, can be repeated.")
+    parser.add_argument('--no-ignore-files', action='store_true',
+                        help="Dont honor .gitignore and .prettifyignore.")
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help="Process only shard i of N of a folder, "
+                        "balanced by Bytes, and save its manifest.")
+    parser.add_argument('--manifest', type=str, metavar='JSON',
+                        help="Path of the manifest of --shard or --merge, "
+                        + SHARD_MANIFEST.format("i", "N") + " for shards.")
+    parser.add_argument('--merge', nargs='+', metavar='JSON',
+                        help="Merge the manifests of all the shards, exit "
+                        "with 1 if files are missing or failed.")
+    parser.add_argument('--archive-out', type=str, metavar='PATH',
+                        help="Write the prettified .tar / .tar.gz / .zip "
+                        "there, instead of over the archive given.")
+    parser.add_argument('--jobs', type=int, metavar='N',
+                        help="Number of processes for folders, 1 for none.")
+    parser.add_argument('--threads', action='store_true',
+                        help="Use threads instead of processes for folders, "
+                        "faster for lots of small files.")
+    parser.add_argument('--asyncio', action='store_true',
+                        help="Overlap reads, prettify and writes of folders "
+                        "on an asyncio pipeline, for slow or network disks.")
+    parser.add_argument('--in-flight', type=int, default=IN_FLIGHT,
+                        metavar='N', help="Files on the asyncio pipeline at "
+                        "once, bounds its memory.")
+    parser.add_argument('--max-worker-mem', type=int, metavar='MB',
+                        help="Free memory of workers over MB after each "
+                        "file, recycle them to stay under it.")
+    parser.add_argument('--max-tasks-per-child', type=int, metavar='N',
+                        help="Replace workers after N files, {} with "
+                        "--max-worker-mem.".format(TASKS_PER_CHILD))
+    parser.add_argument('--profile', action='store_true',
+                        help="Log the slowest files and stages of the run.")
+    parser.add_argument('--metrics', type=str, metavar='JSON',
+                        help="Save the metrics of every file to a JSON file.")
+    parser.add_argument('--cprofile', type=int, default=0, metavar='N',
+                        help="Keep cProfile dumps of the slowest N files.")
+    parser.add_argument('--cprofile-dir', type=str,
+                        help="Folder to save the cProfile dumps, "
+                        "css-html-prettify-profiles on the temp folder.")
+    parser.add_argument('--serve', type=str, metavar='SOCKET',
+                        help="Run as a daemon serving on a Unix socket.")
+    parser.add_argument('--connect', type=str, metavar='SOCKET',
+                        help="Send the file or StdIn '-' to a daemon.")
+    parser.add_argument('--workers', type=int,
+                        help="Number of processes of the daemon Pool.")
+    parser.add_argument('--concurrency', type=int,
+                        help="Maximum requests processed at the same time.")
+    return parser.parse_args()
 
 
 def only_on_py3(boolean_argument=True):
@@ -534,47 +3054,159 @@ def only_on_py3(boolean_argument=True):
 
 def main():
     """Main Loop."""
-    make_arguments_parser()
-    if only_on_py3(args.checkupdates):
-        check_for_updates()
+    args = make_arguments_parser()
+    profile_dir = profile_folder(args.cprofile_dir) if args.cprofile else None
+    # Folders are run again and again with few changes, single files not.
+    cache = not args.no_cache and bool(
+        args.cache or args.fullpath and os.path.isdir(args.fullpath))
+    options = Options(
+        group=args.group, justify=args.justify, prefix=args.prefix,
+        timestamp=args.timestamp, golden=args.golden, cache=cache,
+        cache_dir=args.cache_dir, cache_size=args.cache_size,
+        split_threshold=args.split_threshold * 1024, stream=args.stream,
+        html_engine=args.html_engine, html_parser=args.html_parser,
+        profile=bool(args.profile or args.metrics or args.cprofile or
+                     args.shard),
+        profile_dir=profile_dir, check=args.check, diff=args.diff,
+        minify=args.minify, max_worker_mem=args.max_worker_mem,
+        tasks_per_child=args.max_tasks_per_child)
     if only_on_py3(args.quiet):
         log.disable(log.CRITICAL)
+    else:
+        make_logger()
+    if only_on_py3(args.checkupdates):
+        check_for_updates()
+    if args.stream and (args.justify or args.golden):
+        log.warning("--stream of CSS is ignored with --justify or --golden.")
+    if args.connect and args.fullpath:
+        sys.exit(0 if run_client(args.connect, args.fullpath, options) else 1)
     log.info(__doc__ + __version__)
-    if only_on_py3((args.before, getoutput)):
+    if args.serve:
+        sys.exit(serve(args.serve, args.workers, args.concurrency))
+    if args.merge:
+        sys.exit(merge_command(args.merge, args.manifest))
+    if only_on_py3(args.before):
+        from subprocess import getoutput
         log.info(getoutput(str(args.before)))
     # Work based on if argument is file or folder, folder is slower.
-    if os.path.isfile(args.fullpath
+    if not args.fullpath:
+        log.critical("Argument fullpath is required, except for --serve "
+                     "and --merge.")
+        sys.exit(1)
+    elif args.fullpath == "-":
+        log.info("Target is StdIn to StdOut.")
+        list_of_files = "-"
+        results = [process_stdin(options)]
+    elif os.path.isfile(args.fullpath
                       ) and args.fullpath.endswith((".css", ".scss")):
         log.info("Target is a CSS / SCSS File.")
         list_of_files = str(args.fullpath)
-        process_single_css_file(args.fullpath)
+        results = [process_single_css_file(args.fullpath, options)]
     elif os.path.isfile(args.fullpath
                         ) and args.fullpath.endswith((".htm", ".html")):
         log.info("Target is a HTML File.")
         list_of_files = str(args.fullpath)
-        process_single_html_file(args.fullpath)
+        results = [process_single_html_file(args.fullpath, options)]
+    elif os.path.isfile(args.fullpath) and is_archive(args.fullpath):
+        log.info("Target is an Archive with CSS / SCSS, HTML.")
+        named_results = prettify_archive(
+            args.fullpath, args.archive_out, (".css", ".scss", ".html",
+                                              ".htm"), ".min.css", options,
+            args.jobs, args.in_flight)
+        list_of_files = tuple(name for name, _ in named_results)
+        results = [result for _, result in named_results]
     elif os.path.isdir(args.fullpath):
         log.info("Target is a Folder with CSS / SCSS, HTML, JS.")
         log.warning("Processing a whole Folder may take some time...")
-        list_of_files = walkdir_to_filelist(
-            args.fullpath, (".css", ".scss", ".html", ".htm"), ".min.css")
-        pool = Pool(cpu_count())  # Multiprocessing Async
-        pool.map_async(process_multiple_files, list_of_files)
-        pool.close()
-        pool.join()
+        target, omit = (".css", ".scss", ".html", ".htm"), ".min.css"
+        list_of_files = []
+        if args.watch:
+            watch_folder(args.fullpath, target, omit, options, args.exclude,
+                         () if args.no_ignore_files else IGNORE_FILES)
+            results = []
+        else:
+            paths = iter_target_files(
+                args.fullpath, target, omit, args.prefix, args.exclude,
+                () if args.no_ignore_files else IGNORE_FILES)
+            if args.shard:
+                sizes, tree = shard_files(paths, args.fullpath, *args.shard)
+                paths = list(sizes)
+                log.info("Shard %s/%s: %s of %s files, %s of %s Bytes.",
+                         args.shard[0], args.shard[1], len(sizes),
+                         tree["files"], sum(sizes.values()), tree["bytes"])
+            paths = _recording(paths, list_of_files)
+            if args.asyncio:
+                results = prettify_files_async(paths, options, args.jobs,
+                                               args.in_flight)
+            else:
+                results = prettify_files(paths, options, workers=args.jobs,
+                                         threads=args.threads)
+            if args.shard:
+                write_manifest(args.manifest or SHARD_MANIFEST.format(
+                    *args.shard), shard_manifest(
+                        args.fullpath, sizes, results, args.shard, tree,
+                        options))
+        list_of_files = tuple(list_of_files)
     else:
         log.critical("File or folder not found,or cant be read,or I/O Error.")
         sys.exit(1)
-    if only_on_py3((args.after, getoutput)):
+    if only_on_py3(args.after):
+        from subprocess import getoutput
         log.info(getoutput(str(args.after)))
     log.info('-' * 80)
-    log.info('Files Processed: {}.'.format(list_of_files))
+    log.info('Files Processed: %s.', list_of_files)
     log.info('Number of Files Processed: {}'.format(
         len(list_of_files) if isinstance(list_of_files, tuple) else 1))
-    log.info('Total Maximum RAM Memory used: ~{} MegaBytes.'.format(int(
-        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
-        resource.getpagesize() / 1024 / 1024 if resource else 0)))
+    if options.cache:
+        cache_statuses = [result.cache_status for result in results]
+        log.info('Cache Hits: {}, Cache Misses: {}.'.format(
+            cache_statuses.count(CACHE_HIT), cache_statuses.count(CACHE_MISS)))
+        if cache_writable(options):
+            cache_evict(options.cache_dir, options.cache_size * 1024 * 1024)
+    counters = worker_counters(results)
+    memo_hits, memo_misses, _ = map(sum, zip(*counters.values()))
+    if memo_hits or memo_misses:
+        log.info('Sorted Blocks Memo Hits: {}, Misses: {}, Hit Rate: {:.0%}.'
+                 .format(memo_hits, memo_misses,
+                         memo_hits / (memo_hits + memo_misses)))
+    if options.profile:
+        report_metrics(results, args.metrics, args.cprofile)
+    log.info('Maximum RAM Memory used by this process: ~{} MegaBytes.'.format(
+        int(peak_memory_megabytes())))
+    workers_peaks = [peak for pid, (_, _, peak) in counters.items()
+                     if pid != os.getpid()]
+    if workers_peaks:
+        log.info('Maximum RAM Memory used by {} Workers: ~{} MegaBytes the '
+                 'biggest, ~{} MegaBytes all added.'.format(
+                     len(workers_peaks), int(max(workers_peaks)),
+                     int(sum(workers_peaks))))
     log.info('Total Processing Time: {}.'.format(datetime.now() - start_time))
+    paths = (list_of_files if isinstance(list_of_files, tuple) else
+             (list_of_files, ))
+    if options.diff:
+        for result in results:
+            if result.diff:
+                sys.stdout.write(result.diff)
+        sys.stdout.flush()
+    changed = [path for path, result in zip(paths, results)
+               if result.ok and result.changed]
+    if options.check or options.diff:
+        for file_path in changed:
+            log.warning('Would change: %s.', file_path)
+        log.info('Files that would change: %s of %s.', len(changed),
+                 len(results))
+    else:
+        log.info('Files changed: %s of %s.', len(changed), len(results))
+    failed = [result for result in results if not result.ok]
+    if failed:
+        log.error('Files Failed: %s of %s.', len(failed), len(results))
+        if isinstance(list_of_files, tuple):
+            for file_path, result in zip(list_of_files, results):
+                if result.error:
+                    log.error('Failed: %s, %s.', file_path, result.error)
+        sys.exit(1)
+    if options.check and changed:
+        sys.exit(1)
 
 
 if __name__ in '__main__':
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+
+"""Shared fixtures for the CSS-HTML-Prettify tests."""
+
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "css-html-prettify.py")
+
+
+@pytest.fixture(scope="session")
+def prettifier():
+    """Import css-html-prettify.py as a module, the dashes forbid import.
+
+    Its on sys.modules, so its functions can be pickled to Pool workers.
+    """
+    spec = importlib.util.spec_from_file_location("css_html_prettify", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def read_asset():
+    """Return a function that reads a file bundled on the repo."""
+    def read(relative_path):
+        with open(os.path.join(ROOT, relative_path),
+                  encoding="utf-8-sig") as asset:
+            return asset.read()
+    return read
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+
+"""Tests of the cache of outputs, that lint runs leave untouched."""
+
+
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPT
+
+
+@pytest.mark.parametrize("lint, entries", (
+    ({}, 2), ({"check": True}, 0), ({"diff": True}, 0)))
+def test_only_writing_runs_write_the_cache(prettifier, tmp_path, lint,
+                                           entries):
+    cache_dir = tmp_path / "cache"
+    (tmp_path / "a.css").write_text("a{color:red}")
+    (tmp_path / "b.html").write_text("<p>b</p>")
+    options = prettifier.Options(cache=True, cache_dir=str(cache_dir),
+                                 **lint)
+    results = prettifier.prettify_files(
+        [str(tmp_path / "a.css"), str(tmp_path / "b.html")], options,
+        workers=1)
+    assert all(result.ok for result in results)
+    written = list(cache_dir.iterdir()) if cache_dir.exists() else []
+    assert len(written) == entries
+
+
+@pytest.mark.parametrize("target, flags, entries", (
+    ("a.css", (), 0), ("a.css", ("--cache", ), 1), ("", (), 1),
+    ("", ("--no-cache", ), 0)))
+def test_cache_is_opt_in_except_for_folders(tmp_path, target, flags,
+                                            entries):
+    cache_dir, site = tmp_path / "cache", tmp_path / "site"
+    site.mkdir()
+    (site / "a.css").write_text("a{color:red}")
+    subprocess.check_call((sys.executable, SCRIPT, "--quiet", "--cache-dir",
+                           str(cache_dir), str(site / target)) + flags)
+    written = list(cache_dir.iterdir()) if cache_dir.exists() else []
+    assert len(written) == entries
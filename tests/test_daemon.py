@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+
+"""Tests of the daemon socket handling and its cache eviction."""
+
+
+import socket
+
+import pytest
+
+
+def test_serve_keeps_a_regular_file(prettifier, tmp_path):
+    path = tmp_path / "important.txt"
+    path.write_text("keep me")
+    assert prettifier.serve(str(path), workers=1) == 1
+    assert path.read_text() == "keep me"
+
+
+def test_stale_socket_is_removed(prettifier, tmp_path):
+    path = str(tmp_path / "stale.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(path)  # Bound but not listening, like a dead daemon.
+    prettifier.remove_stale_socket(path)
+    assert not (tmp_path / "stale.sock").exists()
+
+
+def test_live_daemon_socket_is_kept(prettifier, tmp_path):
+    path = str(tmp_path / "live.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as live:
+        live.bind(path)
+        live.listen(1)
+        with pytest.raises(IOError):
+            prettifier.remove_stale_socket(path)
+        assert (tmp_path / "live.sock").exists()
+
+
+def test_daemon_evicts_its_cache(prettifier, tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    for index in range(4):
+        (cache_dir / str(index)).write_bytes(b"x" * 1024 * 1024)
+    options = prettifier.Options(cache=True, cache_dir=str(cache_dir),
+                                 cache_size=2)
+    prettifier.EVICTED_AT.clear()
+    prettifier.evict_from_time_to_time(options)
+    assert len(list(cache_dir.iterdir())) <= 2
+
+
+@pytest.mark.parametrize("name", ("notes.txt", "folder.css"))
+def test_daemon_only_takes_css_and_html(prettifier, tmp_path, name):
+    path = tmp_path / name
+    if name == "folder.css":
+        path.mkdir()
+    else:
+        path.write_text("<p>keep me</p>")
+    response = prettifier.handle_request(
+        {"path": str(path), "options": {"cache": False}}, pool=None)
+    assert response["ok"] is False and "Not a CSS" in response["error"]
+    assert prettifier.run_client(str(tmp_path / "none.sock"), str(path),
+                                 prettifier.Options()) is False
+    if name == "notes.txt":
+        assert path.read_text() == "<p>keep me</p>"
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+
+"""Golden tests, every CSS engine and path must give the Legacy output.
+
+Legacy shares its sorting, normalizing and justifying with the Rules
+engine, so both are pinned to tests/golden too, the outputs of the bundled
+assets by the original css-html-prettify.py, before any engine was added.
+"""
+
+
+import os
+import random
+
+import pytest
+
+from conftest import ROOT
+
+
+ASSETS = ("commoninfobae.css", "infobae.css", "publicidad.css", "reset.css",
+          "responsive.css", "info.min.css",
+          "fonts-redes/css/font-awesome.css",
+          "fonts-redes/css/font-awesome.min.css")
+FRAGMENTS = ("a", " ", "  ", "\n", "\n\n", "\r\n", "\t", "{", "}", "{\n",
+             "  {\n", "\n  {", ";", ";;", " ;", ":", "0px", " 0em", "0",
+             "/*", "*/", "/* c { */", "@media screen", ".sel ", "a:b:c;",
+             "color: red;", "margin:0em", "top:0;", "width: 100%;\n",
+             "-webkit-transition: x;\n", "z-index: 1; color: red;\n",
+             "\n" * 7, "x" * 40, '"', "'")
+GOLDEN = os.path.join(ROOT, "tests", "golden")
+
+
+def random_css(seed):
+    """Return CSS, not always valid, made of random FRAGMENTS."""
+    generator = random.Random(seed)
+    css = "".join(generator.choice(FRAGMENTS)
+                  for _ in range(generator.randint(0, 150)))
+    return "@charset x;" + css if generator.random() < 0.1 else css
+
+
+def pieces(css, seed):
+    """Return css cut on random places, like reads of a stream."""
+    generator = random.Random(seed)
+    cuts = sorted(generator.randint(0, len(css)) for _ in range(5))
+    return [css[start:end] for start, end in zip([0] + cuts, cuts + [
+        len(css)])]
+
+
+def assert_engines_agree(prettifier, css, group, justify):
+    """Assert the Rules engine, split and stream paths give the Legacy CSS."""
+    golden = prettifier.legacy_css_prettify(css, justify=justify,
+                                            group=group)
+    assert prettifier.css_prettify(css, justify=justify, group=group) == (
+        golden)
+    chunks = prettifier.split_css(css, 64)
+    assert "".join(chunks) == css
+    assert prettifier._reduce_rules(map(
+        lambda chunk: prettifier._format_rules(chunk, group=group), chunks),
+        css, justify=justify) == golden
+    if not justify:
+        assert "".join(prettifier.iter_css_prettify(
+            iter(pieces(css, len(css))), group, chunk_size=64)) == golden
+
+
+@pytest.mark.parametrize("group", (False, True))
+@pytest.mark.parametrize("justify", (False, True))
+@pytest.mark.parametrize("name", ASSETS)
+def test_assets(prettifier, read_asset, name, group, justify):
+    assert_engines_agree(prettifier, read_asset(name), group, justify)
+
+
+def read_golden(name, group, justify):
+    """Return the expected output of a bundled asset, by the original."""
+    golden_name = "{}{}{}.css".format(os.path.basename(name)[:-4],
+                                      "-group" if group else "",
+                                      "-justify" if justify else "")
+    with open(os.path.join(GOLDEN, golden_name), encoding="utf-8",
+              newline="") as golden:
+        return golden.read()
+
+
+@pytest.mark.parametrize("group", (False, True))
+@pytest.mark.parametrize("justify", (False, True))
+@pytest.mark.parametrize("name", ASSETS)
+def test_assets_match_the_original(prettifier, read_asset, name, group,
+                                   justify):
+    css, expected = read_asset(name), read_golden(name, group, justify)
+    assert prettifier.css_prettify(css, justify=justify, group=group) == (
+        expected)
+    assert prettifier.legacy_css_prettify(css, justify=justify,
+                                          group=group) == expected
+
+
+@pytest.mark.parametrize("group", (False, True))
+@pytest.mark.parametrize("justify", (False, True))
+def test_random_css(prettifier, group, justify):
+    for seed in range(300):
+        assert_engines_agree(prettifier, random_css(seed), group, justify)
+
+
+def test_parallel_engine(prettifier, read_asset):
+    css = read_asset("commoninfobae.css")
+    assert prettifier.parallel_css_prettify(css, chunk_size=1024) == (
+        prettifier.legacy_css_prettify(css))
+
+
+def test_golden_compare(prettifier, read_asset):
+    assert prettifier.golden_compare(read_asset("infobae.css")) == -1
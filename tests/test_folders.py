@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+
+"""Tests of prettify_files() on process and thread Pools."""
+
+
+import shutil
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """Return paths of copies of some bundled CSS and HTML files."""
+    paths = []
+    for name in ("reset.css", "responsive.css", "publicidad.css",
+                 "info.html"):
+        paths.append(str(tmp_path / name))
+        shutil.copyfile("{}/{}".format(ROOT, name), paths[-1])
+    return paths
+
+
+@pytest.mark.parametrize("threads", (False, True))
+def test_prettify_files_on_pools(prettifier, folder, threads):
+    options = prettifier.Options(cache=False)
+    results = prettifier.prettify_files(folder, options, workers=2,
+                                        threads=threads)
+    assert [result.ok for result in results] == [True] * len(folder)
+
+
+def test_threads_ignore_worker_recycling(prettifier, folder):
+    options = prettifier.Options(cache=False, max_worker_mem=1024,
+                                 tasks_per_child=1)
+    results = prettifier.prettify_files(folder, options, workers=2,
+                                        threads=True)
+    assert all(result.ok for result in results)
+
+
+@pytest.mark.parametrize("cpus, splits", ((1, False), (4, True)))
+def test_split_on_main_thread_with_cpus(prettifier, monkeypatch, cpus,
+                                        splits):
+    monkeypatch.setattr("multiprocessing.cpu_count", lambda: cpus)
+    assert prettifier.can_split() is splits
+
+
+def test_threads_do_not_split(prettifier, folder, monkeypatch):
+    def parallel_css_prettify(*args, **kwargs):
+        raise AssertionError("A thread worker started a Pool.")
+    monkeypatch.setattr("multiprocessing.cpu_count", lambda: 4)
+    monkeypatch.setattr(prettifier, "parallel_css_prettify",
+                        parallel_css_prettify)
+    options = prettifier.Options(cache=False, split_threshold=1)
+    results = prettifier.prettify_files(folder, options, workers=2,
+                                        threads=True)
+    assert [result.error for result in results] == [None] * len(folder)
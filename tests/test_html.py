@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+
+"""Tests of the Stream HTML engine, the default one."""
+
+
+import pytest
+
+
+@pytest.mark.parametrize("html, pretty_html", (
+    ("<p>a<br>b<img src=x></p>",
+     "<p>\n    a\n    <br>\n    b\n    <img src=x>\n</p>\n\n"),
+    ("<br/><img src=x /></img>", "<br/>\n<img src=x />\n\n"),
+    ("<div><pre>  a\n    <b>x</b>  </pre></div>",
+     "<div>\n    <pre>  a\n    <b>x</b>  </pre>\n</div>\n\n"),
+    ("<script>if (a < b) { c(); }</script>",
+     "<script>if (a < b) { c(); }</script>\n\n"),
+    ("<style>a  >  b { }</style>", "<style>a  >  b { }</style>\n\n"),
+    ("<textarea>  x\n y</textarea>", "<textarea>  x\n y</textarea>\n\n"),
+))
+def test_void_and_raw_elements(prettifier, html, pretty_html):
+    assert prettifier.html_prettify(html) == pretty_html
+
+
+@pytest.mark.parametrize("html, pretty_html", (
+    ("<ul><li>one<li>two</ul>",
+     "<ul>\n    <li>\n        one\n    <li>\n        two\n</ul>\n\n"),
+    ("<p>a<p>b<div>c</div>",
+     "<p>\n    a\n<p>\n    b\n<div>\n    c\n</div>\n\n"),
+    ("<table><tr><td>a<td>b<tr><td>c</table>",
+     "<table>\n    <tr>\n        <td>\n            a\n        <td>\n"
+     "            b\n    <tr>\n        <td>\n            c\n</table>\n\n"),
+    ("<dl><dt>a<dd>b</dl>",
+     "<dl>\n    <dt>\n        a\n    <dd>\n        b\n</dl>\n\n"),
+))
+def test_implied_end_tags(prettifier, html, pretty_html):
+    assert prettifier.html_prettify(html) == pretty_html
+
+
+@pytest.mark.parametrize("html, pretty_html", (
+    ("<![CDATA[x]]><div>a</div>",
+     "<![CDATA[x]]>\n<div>\n    a\n</div>\n\n"),
+    ("<![CDATA[a]b]]>", "<![CDATA[a]b]]>\n\n"),
+    ("<svg><![CDATA[a<b]]></svg>",
+     "<svg>\n    <![CDATA[a<b]]>\n</svg>\n\n"),
+    ("<pre> <![CDATA[ a  b ]]></pre>", "<pre> <![CDATA[ a  b ]]></pre>\n\n"),
+    ("<![if !IE]><p>x</p><![endif]>",
+     "<![if !IE]>\n<p>\n    x\n</p>\n<![endif]>\n\n"),
+))
+def test_marked_sections_are_kept(prettifier, html, pretty_html):
+    assert prettifier.html_prettify(html) == pretty_html
+
+
+def test_idempotent(prettifier, read_asset):
+    pretty_html = prettifier.html_prettify(read_asset("info.html"))
+    assert prettifier.html_prettify(pretty_html) == pretty_html
+
+
+@pytest.mark.parametrize("size", (1, 7, 100, 4096))
+def test_pieces(prettifier, read_asset, size):
+    html = read_asset("info.html")
+    pieces = (html[start:start + size] for start in range(0, len(html),
+                                                          size))
+    assert "".join(prettifier.iter_html_prettify(pieces)) == (
+        prettifier.html_prettify(html))
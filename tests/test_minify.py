@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+
+"""Tests of --minify, mostly of what it must keep."""
+
+
+import pytest
+
+
+@pytest.mark.parametrize("css, minified", (
+    ('a{content:"x{}"}', 'a{content:"x{}"}'),
+    ("a{content:'}'}b{}", "a{content:'}'}"),
+    ('a[title="{}"]{color:red}', 'a[title="{}"]{color:red}'),
+    ("/* x{} */a{color:red}", "a{color:red}"),
+    ("/* } */a{color:red}", "a{color:red}"),
+    ("a{color:red/* {} */}", "a{color:red}"),
+    ("/*! a{b:c} */d{color:red}", "/*! a{b:c} */d{color:red}"),
+    ("a{}/*! c{} */@media x{b{}}", "/*! c{} */"),
+    ("@media x{a{}b{}}c{color:red}", "c{color:red}"),
+    ("a { color : red ; }", "a{color:red}"),
+))
+def test_minify(prettifier, css, minified):
+    assert prettifier.css_minify(css) == minified
+    assert prettifier.css_prettify_and_minify(css)[1] == minified
+
+
+def test_minify_assets_once_or_with_pretty(prettifier, read_asset):
+    for name in ("commoninfobae.css", "fonts-redes/css/font-awesome.css"):
+        css = read_asset(name)
+        pretty_css, minified = prettifier.css_prettify_and_minify(css)
+        assert pretty_css == prettifier.css_prettify(css)
+        assert minified == prettifier.css_minify(css)
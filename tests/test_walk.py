@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+
+"""Tests of the folder walk and the watchers, what they skip."""
+
+
+import pytest
+
+
+TARGET, OMIT = (".css", ".scss", ".html", ".htm"), ".min.css"
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Return a folder with files to process and files to skip."""
+    for relative_path in ("publicidad.css", "reset.css", "preset.css",
+                          "src/a.css", "src/build/b.css",
+                          "node_modules/lib/c.css", ".git/d.css",
+                          "ignored/e.css", "f.min.css"):
+        path = tmp_path / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("a{color:red}")
+    (tmp_path / ".gitignore").write_text("ignored/\n")
+    return tmp_path
+
+
+def walk(prettifier, tree, prefix=None):
+    return sorted(
+        path[len(str(tree)) + 1:] for path in prettifier.iter_target_files(
+            str(tree), TARGET, OMIT, prefix, exclude=("build", )))
+
+
+def test_walk_skips_excluded_and_ignored(prettifier, tree):
+    assert walk(prettifier, tree) == [
+        "preset.css", "publicidad.css", "reset.css", "src/a.css"]
+
+
+def test_walk_skips_only_outputs_of_the_prefix(prettifier, tree):
+    # preset.css is the output of reset.css, publicidad.css an input.
+    assert walk(prettifier, tree, prefix="p") == [
+        "publicidad.css", "reset.css", "src/a.css"]
+
+
+def collect(changes):
+    """Return the paths changes yields until it yields None."""
+    paths = []
+    for path in changes:
+        if path is None:
+            return paths
+        paths.append(path)
+
+
+def touch_all(tree):
+    for relative_path in ("src/new.css", "src/build/new.css",
+                          "node_modules/lib/new.css", ".git/new.css",
+                          "ignored/new.css"):
+        (tree / relative_path).write_text("b{color:blue}")
+
+
+def test_polling_skips_excluded_and_ignored(prettifier, tree):
+    changes = prettifier.polling_changes(str(tree), 0.01, ("build", ))
+    collect(changes)
+    touch_all(tree)
+    assert collect(changes) == [str(tree / "src" / "new.css")]
+
+
+def test_inotify_skips_excluded_and_ignored(prettifier, tree):
+    try:
+        changes = prettifier.inotify_changes(str(tree), 0.2, ("build", ))
+    except Exception as error:
+        pytest.skip("Inotify not available: {}.".format(error))
+    touch_all(tree)
+    assert sorted(set(collect(changes))) == [str(tree / "src" / "new.css")]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+
+"""Tests of writing the outputs in place, and of the lint modes that don't."""
+
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPT
+
+
+UGLY_CSS = "a{color:red}"
+
+
+@pytest.mark.parametrize("stream", (False, True))
+def test_symlinks_are_written_thru(prettifier, tmp_path, stream):
+    real, alias = tmp_path / "real.css", tmp_path / "alias.css"
+    real.write_text(UGLY_CSS)
+    alias.symlink_to(real)
+    result = prettifier.process_single_css_file(
+        str(alias), prettifier.Options(stream=stream))
+    assert result.ok and result.changed
+    assert alias.is_symlink()
+    assert real.read_text() == prettifier.css_prettify(UGLY_CSS)
+    assert not [path for path in os.listdir(tmp_path)
+                if path.endswith(".tmp")]
+
+
+@pytest.mark.parametrize("lint, stdout", (("--check", ""), ("--diff", "+")))
+def test_lint_modes_leave_files_untouched(tmp_path, lint, stdout):
+    ugly = tmp_path / "ugly.css"
+    ugly.write_text(UGLY_CSS)
+    os.utime(ugly, (1, 1))
+    run = subprocess.run((sys.executable, SCRIPT, "--quiet", lint,
+                          str(ugly)), stdout=subprocess.PIPE,
+                         universal_newlines=True)
+    assert run.returncode == (1 if lint == "--check" else 0)
+    assert stdout in run.stdout
+    assert ugly.read_text() == UGLY_CSS
+    assert ugly.stat().st_mtime == 1
+
+
+def test_check_passes_on_pretty_files(tmp_path):
+    pretty = tmp_path / "pretty.css"
+    pretty.write_text(UGLY_CSS)
+    subprocess.check_call((sys.executable, SCRIPT, "--quiet", str(pretty)))
+    assert pretty.read_text() != UGLY_CSS
+    subprocess.check_call((sys.executable, SCRIPT, "--quiet", "--check",
+                           str(pretty)))